@@ -1,6 +1,13 @@
 import sys
 import abc
-from collections import deque
+import ast
+import functools
+import array
+import hashlib
+import asyncio
+import difflib
+from collections import deque, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 import re
 from typing import NamedTuple
 
@@ -8,27 +15,34 @@ import json
 from dotenv import load_dotenv
 import numpy as np
 import os
+import queue
+import random
+import shutil
+import string
 import openai
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 import requests
 import sqlite3
 import subprocess
+import threading
 import time
+import weakref
+import httpx
 from xai_components.base import InArg, OutArg, InCompArg, Component, xai_component
 
 load_dotenv()
 
 DEFAULT_EXECUTOR_PROMPT = """
 You are an AI who performs one task based on the following objective: {objective}.
-Take into account these previously completed tasks: {context}
-*Your thoughts*: {scratch_pad}
-*Your task*: {task}
 *Your tools*: {tools}
 You can use a tool by writing TOOL: TOOL_NAME in a single line. then the arguments of the tool (if any) For example, to use the python-exec tool, write
 TOOL: python-exec
 ```
 print('Hello world!')
 ```
+Take into account these previously completed tasks: {context}
+*Your thoughts*: {scratch_pad}
+*Your task*: {task}
 Response:
 """
 
@@ -54,23 +68,98 @@ Return the tasks as an array.
 """
 
 DEFAULT_TASK_PRIORITIZER_PROMPT = """
-You are a task prioritization AI tasked with cleaning the formatting of and reprioritizing the following tasks:
-{task_names}.
+You are a task prioritization AI tasked with cleaning the formatting of and reprioritizing a list of tasks.
 Consider the ultimate objective of your team:{objective}. Do not remove any tasks.
 Return the result as a numbered list, like:
 #. First task
 #. Second task
+The tasks to prioritize: {task_names}.
 Start the task list with number {next_task_id}.
 """
 
+# Used with `structured`, where STRUCTURED_TASKS_INSTRUCTION describes the output format.
+DEFAULT_STRUCTURED_TASK_PRIORITIZER_PROMPT = """
+You are a task prioritization AI tasked with cleaning the formatting of and reprioritizing a list of tasks.
+Consider the ultimate objective of your team:{objective}. Do not remove any tasks.
+The tasks to prioritize: {task_names}.
+"""
+
 
 class Memory(abc.ABC):
-    def query(self, query: str, n: int) -> list:
+    """Vector memory used by the agents for context retrieval.
+
+    `filter` uses Pinecone's metadata filter syntax: {"task_id": 3} for equality, operators
+    such as {"task_id": {"$gte": 2, "$lt": 5}} ($eq, $ne, $gt, $gte, $lt, $lte, $in, $nin,
+    $exists) and "$and"/"$or" lists. A namespace keeps separate collections (for example
+    one per objective) apart in the same memory; queries without one see every entry.
+    """
+
+    # True when query() already returns results ranked best-first.
+    sorted_results = False
+    # Incremented by every write made through this instance, so cached retrievals can tell they are stale.
+    version = 0
+
+    def query(self, query: str, n: int, filter: dict = None, namespace: str = None) -> list:
         pass
 
-    def add(self, id: str, text: str, metadata: dict) -> None:
+    def add(self, id: str, text: str, metadata: dict, namespace: str = None) -> None:
         pass
 
+    def query_many(self, queries: list, n: int, filter: dict = None, namespace: str = None) -> list:
+        """Runs several queries; implementations override this to batch the embeddings and search."""
+        return [self.query(query, n, filter=filter, namespace=namespace) for query in queries]
+
+    def add_many(self, ids: list, texts: list, metadatas: list, namespace: str = None) -> None:
+        """Adds several entries; implementations override this to batch the embeddings and writes."""
+        for id, text, metadata in zip(ids, texts, metadatas):
+            self.add(id, text, metadata, namespace=namespace)
+
+
+FILTER_RANGE_OPERATORS = {
+    '$gt': lambda a, b: a > b,
+    '$gte': lambda a, b: a >= b,
+    '$lt': lambda a, b: a < b,
+    '$lte': lambda a, b: a <= b,
+}
+
+
+def metadata_matches(metadata: dict, filter: dict) -> bool:
+    """Evaluates a Memory metadata filter against one metadata dict."""
+    for field, condition in filter.items():
+        if field == '$and':
+            if not all(metadata_matches(metadata, sub) for sub in condition):
+                return False
+            continue
+        if field == '$or':
+            if not any(metadata_matches(metadata, sub) for sub in condition):
+                return False
+            continue
+
+        if not isinstance(condition, dict):
+            condition = {'$eq': condition}
+        value = metadata.get(field)
+        for op, arg in condition.items():
+            if op == '$eq':
+                matched = field in metadata and value == arg
+            elif op == '$ne':
+                matched = value != arg
+            elif op == '$in':
+                matched = field in metadata and value in arg
+            elif op == '$nin':
+                matched = value not in arg
+            elif op == '$exists':
+                matched = (field in metadata) == bool(arg)
+            elif op in FILTER_RANGE_OPERATORS:
+                try:
+                    matched = FILTER_RANGE_OPERATORS[op](float(value), float(arg))
+                except (TypeError, ValueError):
+                    matched = False
+            else:
+                raise Exception(f"Unknown filter operator {op}")
+            if not matched:
+                return False
+    return True
+
 
 def run_tool(tool_code: str, tools: list) -> str:
     if tool_code is None:
@@ -87,62 +176,945 @@ def run_tool(tool_code: str, tools: list) -> str:
     return ret
 
 
-def llm_call(model: str, prompt: str, temperature: float = 0.5, max_tokens: int = 500):
+async def async_run_tool(tool_code: str, tools: list) -> str:
+    """run_tool for async agents: awaits run_tool_async where a tool has it, otherwise runs
+    the blocking run_tool on a worker thread."""
+    if tool_code is None:
+        return ""
+
+    ret = ""
+
+    for tool in tools:
+        if tool_code.startswith(tool["name"]):
+            instance = tool["instance"]
+            if instance:
+                if hasattr(instance, "run_tool_async"):
+                    ret += await instance.run_tool_async(tool_code)
+                else:
+                    ret += await asyncio.to_thread(instance.run_tool, tool_code)
+
+    return ret
+
+
+class ToolBlockParser:
+    """Incrementally splits a streamed action into tool blocks.
+
+    Blocks are cut exactly like run_action_tools cuts a complete action, at every "TOOL: ",
+    so streaming never changes what a tool receives. A block is handed out as soon as the
+    next "TOOL: " arrives, which lets a tool run while the rest of the action streams;
+    the last block is returned by finish().
+    """
+
+    def __init__(self):
+        self.buffer = ""
+
+    def feed(self, chunk: str) -> list:
+        # The last part may still grow (or end in a partial marker), so it stays buffered.
+        *blocks, self.buffer = (self.buffer + chunk).split("TOOL: ")
+        return blocks
+
+    def finish(self) -> list:
+        self.buffer, rest = "", self.buffer
+        return [rest]
+
+
+LLM_CLIENT_MAX_CONNECTIONS = int(os.getenv("LLM_CLIENT_MAX_CONNECTIONS", "20"))
+LLM_CLIENT_MAX_KEEPALIVE = int(os.getenv("LLM_CLIENT_MAX_KEEPALIVE", "10"))
+LLM_CLIENT_KEEPALIVE_EXPIRY = float(os.getenv("LLM_CLIENT_KEEPALIVE_EXPIRY", "30"))
+LLM_CLIENT_TIMEOUT = float(os.getenv("LLM_CLIENT_TIMEOUT", "120"))
+LLM_CLIENT_CONNECT_TIMEOUT = float(os.getenv("LLM_CLIENT_CONNECT_TIMEOUT", "10"))
+
+
+class LLMClientRegistry:
+    """Process-wide pool of OpenAI clients keyed by (model, base_url, api_key).
+
+    Each client owns a keep-alive httpx connection pool so repeated calls from
+    the agent loop reuse connections instead of paying a TLS handshake per call.
+    Async clients are additionally keyed by event loop, since an httpx.AsyncClient
+    pool cannot be shared between loops.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clients = {}
+        self.async_clients = weakref.WeakKeyDictionary()
+        self.configure()
+
+    def configure(self, max_connections: int = None, max_keepalive: int = None,
+                  keepalive_expiry: float = None, timeout: float = None, connect_timeout: float = None):
+        self.max_connections = max_connections or LLM_CLIENT_MAX_CONNECTIONS
+        self.max_keepalive = max_keepalive or LLM_CLIENT_MAX_KEEPALIVE
+        self.keepalive_expiry = keepalive_expiry or LLM_CLIENT_KEEPALIVE_EXPIRY
+        self.timeout = timeout or LLM_CLIENT_TIMEOUT
+        self.connect_timeout = connect_timeout or LLM_CLIENT_CONNECT_TIMEOUT
+        # Clients created with the old settings are dropped so new calls pick up the change.
+        self.close()
+
+    def http_options(self) -> dict:
+        return {
+            'limits': httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive,
+                keepalive_expiry=self.keepalive_expiry
+            ),
+            'timeout': httpx.Timeout(self.timeout, connect=self.connect_timeout)
+        }
+
+    @staticmethod
+    def credentials(base_url: str, api_key: str) -> tuple:
+        """Explicit values, then ones set on the openai module (e.g. by OpenAIAuthorize), then the environment."""
+        return (
+            base_url or openai.base_url or os.getenv("OPENAI_BASE_URL"),
+            api_key or openai.api_key or os.getenv("OPENAI_API_KEY")
+        )
+
+    def client_options(self, base_url: str, api_key: str) -> dict:
+        base_url, api_key = self.credentials(base_url, api_key)
+        # Retries are handled by RetryPolicy in llm_call, not by the SDK.
+        return {
+            'api_key': api_key,
+            'base_url': base_url,
+            'max_retries': 0,
+            'timeout': httpx.Timeout(self.timeout, connect=self.connect_timeout)
+        }
+
+    def get(self, model: str, base_url: str = None, api_key: str = None) -> OpenAI:
+        key = (model,) + self.credentials(base_url, api_key)
+
+        client = self.clients.get(key)
+        if client is not None:
+            return client
+
+        with self.lock:
+            client = self.clients.get(key)
+            if client is None:
+                client = OpenAI(
+                    http_client=httpx.Client(**self.http_options()),
+                    **self.client_options(base_url, api_key)
+                )
+                self.clients[key] = client
+        return client
+
+    def get_async(self, model: str, base_url: str = None, api_key: str = None) -> AsyncOpenAI:
+        loop = asyncio.get_running_loop()
+        key = (model,) + self.credentials(base_url, api_key)
+
+        with self.lock:
+            clients = self.async_clients.setdefault(loop, {})
+            client = clients.get(key)
+            if client is None:
+                client = AsyncOpenAI(
+                    http_client=httpx.AsyncClient(**self.http_options()),
+                    **self.client_options(base_url, api_key)
+                )
+                clients[key] = client
+        return client
+
+    def close(self):
+        with self.lock:
+            clients = list(self.clients.values())
+            self.clients = {}
+            # Async clients can only be closed from their own loop; dropping them lets them be collected.
+            self.async_clients = weakref.WeakKeyDictionary()
+        for client in clients:
+            client.close()
+
+
+llm_clients = LLMClientRegistry()
+
+
+def get_llm_client(model: str, base_url: str = None, api_key: str = None) -> OpenAI:
+    return llm_clients.get(model, base_url, api_key)
+
+
+def get_async_llm_client(model: str, base_url: str = None, api_key: str = None) -> AsyncOpenAI:
+    return llm_clients.get_async(model, base_url, api_key)
+
+
+def llm_base_url(model: str):
+    """Returns the base URL override for an OpenAI-compatible model, or None for the default endpoint."""
+    if model == 'gpt-3.5-turbo' or model == 'gpt-4o-mini':
+        return None
+    elif model.startswith("rwkv"):
+        # Use proxy.
+        proxy_url = os.getenv("RWKV_BASE_URL")
+        if not proxy_url: raise Exception("No proxy set")
+        return proxy_url
+    else:
+        raise Exception(f"Unknown model {model}")
+
+
+def llama_call(prompt: str) -> str:
+    # Spawn a subprocess to run llama.cpp
+    cmd = ["llama/main", "-p", prompt]
+    result = subprocess.run(cmd, shell=True, stderr=subprocess.DEVNULL, stdout=subprocess.PIPE, text=True)
+    return result.stdout.strip()
+
+
+LLM_STOP = ["OUTPUT", ]
+
+
+def chat_messages(prompt: str, prefix: str = None) -> list:
+    # A static prefix goes first in its own message, so providers that cache prompt prefixes
+    # (e.g. OpenAI's automatic prompt caching) can reuse it across calls.
+    if prefix:
+        return [{"role": "system", "content": prefix}, {"role": "user", "content": prompt}]
+    return [{"role": "system", "content": prompt}]
+
+
+def completion_format_options(response_format: dict = None) -> dict:
+    # The tool-call stop word could cut a structured response short, so it only applies to free text.
+    if response_format is None:
+        return {"stop": LLM_STOP}
+    return {"response_format": response_format}
+
+
+def chat_completion(client: OpenAI, model: str, prompt: str, temperature: float, max_tokens: int,
+                    prefix: str = None, response_format: dict = None) -> str:
+    response = client.chat.completions.create(
+        model=model,
+        messages=chat_messages(prompt, prefix),
+        temperature=temperature,
+        max_tokens=max_tokens,
+        n=1,
+        **completion_format_options(response_format)
+    )
+    return response.choices[0].message.content.strip()
+
+
+async def async_chat_completion(client: AsyncOpenAI, model: str, prompt: str, temperature: float, max_tokens: int,
+                                prefix: str = None, response_format: dict = None) -> str:
+    response = await client.chat.completions.create(
+        model=model,
+        messages=chat_messages(prompt, prefix),
+        temperature=temperature,
+        max_tokens=max_tokens,
+        n=1,
+        **completion_format_options(response_format)
+    )
+    return response.choices[0].message.content.strip()
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter for transient LLM errors.
+
+    The delay before attempt n is a random value in [0, min(max_delay, base_delay * 2**n)],
+    raised to the server's Retry-After hint when one is sent. Retrying stops after
+    max_attempts attempts or once the next sleep would pass the total deadline (seconds).
+    """
+
+    def __init__(self, max_attempts: int = 6, base_delay: float = 1.0, max_delay: float = 60.0,
+                 deadline: float = 300.0, jitter: bool = True):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.jitter = jitter
+
+    def is_retryable(self, error: Exception) -> bool:
+        if isinstance(error, openai.APIConnectionError):
+            return True
+        if isinstance(error, openai.APIStatusError):
+            return error.status_code in (408, 409, 429) or error.status_code >= 500
+        return False
+
+    def retry_after(self, error: Exception):
+        response = getattr(error, 'response', None)
+        if response is None:
+            return None
+        headers = response.headers
+        try:
+            if headers.get("retry-after-ms"):
+                return float(headers["retry-after-ms"]) / 1000
+            if headers.get("retry-after"):
+                return float(headers["retry-after"])
+        except ValueError:
+            # HTTP-date form of Retry-After.
+            from email.utils import parsedate_to_datetime
+            try:
+                return max(0.0, parsedate_to_datetime(headers.get("retry-after")).timestamp() - time.time())
+            except (TypeError, ValueError):
+                return None
+        return None
+
+    def next_delay(self, attempt: int, error: Exception, elapsed: float):
+        """Returns the seconds to sleep before the next attempt, or None to give up."""
+        if not self.is_retryable(error) or attempt + 1 >= self.max_attempts:
+            return None
+
+        backoff = min(self.max_delay, self.base_delay * (2 ** attempt))
+        delay = random.uniform(0, backoff) if self.jitter else backoff
+        retry_after = self.retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+
+        if self.deadline is not None and elapsed + delay > self.deadline:
+            return None
+        return delay
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+
+class RateLimiter:
+    """Spaces out requests to one model and makes concurrent callers honour its 429s.
+
+    With requests_per_minute set, each request is given the next free slot 60 /
+    requests_per_minute seconds after the previous one. A 429 pauses every caller of the
+    model for the backoff chosen by the retry policy, instead of each thread discovering
+    the limit on its own.
+    """
+
+    def __init__(self, requests_per_minute: float = None):
+        self.requests_per_minute = requests_per_minute
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+        self.blocked_until = 0.0
+
+    def reserve(self) -> float:
+        """Claims the next request slot and returns the seconds to wait for it."""
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.blocked_until)
+            if self.requests_per_minute:
+                slot = max(slot, self.next_slot)
+                self.next_slot = slot + 60.0 / self.requests_per_minute
+            return slot - now
+
+    def acquire(self) -> None:
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self) -> None:
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def penalize(self, delay: float) -> None:
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+
+
+rate_limiters = {}
+rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(model: str) -> RateLimiter:
+    with rate_limiters_lock:
+        if model not in rate_limiters:
+            rate_limiters[model] = RateLimiter()
+        return rate_limiters[model]
+
+
+def set_rate_limit(model: str, requests_per_minute: float) -> None:
+    limiter = get_rate_limiter(model)
+    with limiter.lock:
+        limiter.requests_per_minute = requests_per_minute
+
+
+class LLMResponseCache:
+    """Content-addressed cache of LLM responses.
+
+    Keys hash (model, prompt, temperature, max_tokens, stop). An in-memory LRU sits in
+    front of an optional SQLite file so cached responses survive restarts. Entries older
+    than ttl seconds are treated as misses, and each tier is trimmed to its size limit by
+    least recent use.
+    """
+
+    def __init__(self, path: str = None, max_memory_entries: int = 1024, max_disk_entries: int = 100000,
+                 ttl: float = None, only_deterministic: bool = False):
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self.only_deterministic = only_deterministic
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.puts_since_trim = 0
+        self.conn = None
+        if path:
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache (accessed)")
+            self.conn.commit()
+
+    def accepts(self, temperature: float) -> bool:
+        return not self.only_deterministic or temperature == 0
+
+    @staticmethod
+    def make_key(model: str, prompt: str, temperature: float, max_tokens: int, stop: list) -> str:
+        payload = json.dumps([model, prompt, temperature, max_tokens, stop], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def expired(self, created: float, now: float) -> bool:
+        return self.ttl is not None and now - created > self.ttl
+
+    def get(self, key: str):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if not self.expired(entry[0], now):
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self.entries[key]
+
+            if self.conn is not None:
+                row = self.conn.execute("SELECT response, created FROM llm_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None and not self.expired(row[1], now):
+                    self.conn.execute("UPDATE llm_cache SET accessed = ? WHERE key = ?", (now, key))
+                    self.conn.commit()
+                    self.remember(key, row[1], row[0])
+                    self.hits += 1
+                    return row[0]
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, response: str) -> None:
+        now = time.time()
+        with self.lock:
+            self.remember(key, now, response)
+            if self.conn is not None:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, response, created, accessed) VALUES (?, ?, ?, ?)",
+                    (key, response, now, now)
+                )
+                self.conn.commit()
+                self.puts_since_trim += 1
+                if self.puts_since_trim >= 100:
+                    self.trim_disk(now)
+
+    def remember(self, key: str, created: float, response: str) -> None:
+        self.entries[key] = (created, response)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_memory_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def trim_disk(self, now: float) -> None:
+        self.puts_since_trim = 0
+        if self.ttl is not None:
+            self.evictions += self.conn.execute("DELETE FROM llm_cache WHERE created < ?", (now - self.ttl,)).rowcount
+        count = self.conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        if count > self.max_disk_entries:
+            self.evictions += self.conn.execute(
+                "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY accessed LIMIT ?)",
+                (count - self.max_disk_entries,)
+            ).rowcount
+        self.conn.commit()
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            if self.conn is not None:
+                self.conn.execute("DELETE FROM llm_cache")
+                self.conn.commit()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'evictions': self.evictions,
+            'memory_entries': len(self.entries)
+        }
+
+
+# Opt-in: set LLM_CACHE_PATH (e.g. for offline workflow test replays) or use the EnableLLMCache component.
+llm_cache = LLMResponseCache(os.getenv("LLM_CACHE_PATH")) if os.getenv("LLM_CACHE_PATH") else None
+
+
+def set_llm_cache(cache: LLMResponseCache) -> None:
+    global llm_cache
+    llm_cache = cache
+
+
+def llm_cache_key(model: str, prompt: str, temperature: float, max_tokens: int, prefix: str = None,
+                  response_format: dict = None):
+    if llm_cache is None or not llm_cache.accepts(temperature):
+        return None
+    if response_format is not None:
+        return llm_cache.make_key(model, [prefix, prompt, response_format], temperature, max_tokens, None)
+    return llm_cache.make_key(model, [prefix, prompt] if prefix else prompt, temperature, max_tokens, LLM_STOP)
+
+
+def call_with_retry(fn, retry_policy: RetryPolicy = None, rate_limiter: RateLimiter = None):
+    policy = retry_policy if retry_policy is not None else DEFAULT_RETRY_POLICY
+    start = time.monotonic()
+    attempt = 0
+    while True:
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        try:
+            return fn()
+        except openai.APIError as e:
+            delay = policy.next_delay(attempt, e, time.monotonic() - start)
+            if delay is None:
+                raise
+            if rate_limiter is not None and getattr(e, 'status_code', None) == 429:
+                rate_limiter.penalize(delay)
+            print(f"{e.__class__.__name__}, retrying in {delay:.1f} seconds...")
+            time.sleep(delay)
+            attempt += 1
+
+
+async def async_call_with_retry(fn, retry_policy: RetryPolicy = None, rate_limiter: RateLimiter = None):
+    policy = retry_policy if retry_policy is not None else DEFAULT_RETRY_POLICY
+    start = time.monotonic()
+    attempt = 0
+    while True:
+        if rate_limiter is not None:
+            await rate_limiter.acquire_async()
+        try:
+            return await fn()
+        except openai.APIError as e:
+            delay = policy.next_delay(attempt, e, time.monotonic() - start)
+            if delay is None:
+                raise
+            if rate_limiter is not None and getattr(e, 'status_code', None) == 429:
+                rate_limiter.penalize(delay)
+            print(f"{e.__class__.__name__}, retrying in {delay:.1f} seconds...")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+def llm_call(model: str, prompt: str, temperature: float = 0.5, max_tokens: int = 500, retry_policy: RetryPolicy = None,
+             prefix: str = None, response_format: dict = None):
     #print("**** LLM_CALL ****")
     #print(prompt)
-    
-    while True:
+
+    cache_key = llm_cache_key(model, prompt, temperature, max_tokens, prefix, response_format)
+    if cache_key is not None:
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    if model.startswith("llama"):
+        response = llama_call((prefix or "") + prompt)
+    else:
+        client = get_llm_client(model, base_url=llm_base_url(model))
+        response = call_with_retry(
+            lambda: chat_completion(client, model, prompt, temperature, max_tokens, prefix, response_format),
+            retry_policy,
+            get_rate_limiter(model)
+        )
+
+    if cache_key is not None:
+        llm_cache.put(cache_key, response)
+    return response
+
+
+async def async_llm_call(model: str, prompt: str, temperature: float = 0.5, max_tokens: int = 500,
+                         retry_policy: RetryPolicy = None, prefix: str = None, response_format: dict = None):
+    """asyncio variant of llm_call. Backoff sleeps yield to the event loop instead of blocking it."""
+    cache_key = llm_cache_key(model, prompt, temperature, max_tokens, prefix, response_format)
+    if cache_key is not None:
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    if model.startswith("llama"):
+        response = await asyncio.to_thread(llama_call, (prefix or "") + prompt)
+    else:
+        client = get_async_llm_client(model, base_url=llm_base_url(model))
+        response = await async_call_with_retry(
+            lambda: async_chat_completion(client, model, prompt, temperature, max_tokens, prefix, response_format),
+            retry_policy,
+            get_rate_limiter(model)
+        )
+
+    if cache_key is not None:
+        llm_cache.put(cache_key, response)
+    return response
+
+
+def llm_stream(model: str, prompt: str, temperature: float = 0.5, max_tokens: int = 500, retry_policy: RetryPolicy = None,
+               prefix: str = None):
+    """Streaming variant of llm_call that yields the completion in chunks as they arrive.
+
+    Only opening the stream is retried; an error after the first chunk is raised to the consumer.
+    Cache hits and llama.cpp completions are yielded as a single chunk.
+    """
+    cache_key = llm_cache_key(model, prompt, temperature, max_tokens, prefix)
+    if cache_key is not None:
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+
+    if model.startswith("llama"):
+        response = llama_call((prefix or "") + prompt)
+        yield response
+    else:
+        client = get_llm_client(model, base_url=llm_base_url(model))
+        stream = call_with_retry(
+            lambda: client.chat.completions.create(
+                model=model,
+                messages=chat_messages(prompt, prefix),
+                temperature=temperature,
+                max_tokens=max_tokens,
+                n=1,
+                stop=LLM_STOP,
+                stream=True,
+            ),
+            retry_policy,
+            get_rate_limiter(model)
+        )
+        parts = []
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+        response = "".join(parts).strip()
+
+    if cache_key is not None:
+        llm_cache.put(cache_key, response)
+
+
+def get_sorted_context(memory: Memory, query: str, n: int, filter: dict = None, namespace: str = None):
+    # Only pass the new arguments when used, so Memory implementations without them keep working.
+    kwargs = {}
+    if filter:
+        kwargs['filter'] = filter
+    if namespace is not None:
+        kwargs['namespace'] = namespace
+    results = memory.query(query, n, **kwargs)
+    if getattr(memory, 'sorted_results', False):
+        sorted_results = results
+    else:
+        sorted_results = sorted(
+            results,
+            key=lambda x: x.similarity if getattr(x, 'similarity', None) else x.score,
+            reverse=True
+        )
+    return [(str(item.attributes['task']) + ":" + str(item.attributes['result'])) for item in sorted_results]
+
+
+CONTEXT_PREFETCH_TTL = float(os.getenv("CONTEXT_PREFETCH_TTL", "30"))
+
+
+class ContextPrefetcher:
+    """Runs get_sorted_context on a thread pool so retrieval overlaps with LLM calls.
+
+    Futures are kept per memory and per query arguments, so the critic reuses the context
+    the executor retrieved for the same task. After writing to a memory, call refresh():
+    it re-runs the recent queries against that memory in the background, so the next
+    task's context is ready by the time the executor asks for it.
+
+    A kept future is only reused while the memory's version is the one it was started at
+    and it is younger than ttl seconds; the ttl covers writes made outside this process.
+    """
+
+    def __init__(self, max_workers: int = 4, max_queries: int = 8, ttl: float = None):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="context-prefetch")
+        self.max_queries = max_queries
+        self.ttl = ttl if ttl is not None else CONTEXT_PREFETCH_TTL
+        self.lock = threading.Lock()
+        self.entries = weakref.WeakKeyDictionary()
+
+    @staticmethod
+    def key(query: str, n: int, filter: dict, namespace: str) -> tuple:
+        return query, n, json.dumps(filter, sort_keys=True, default=str) if filter else None, namespace
+
+    def prefetch(self, memory: Memory, query: str, n: int, filter: dict = None, namespace: str = None) -> Future:
+        version = memory.version
+        started = time.monotonic()
+        future = self.executor.submit(get_sorted_context, memory, query, n, filter, namespace)
+        with self.lock:
+            futures = self.entries.setdefault(memory, OrderedDict())
+            key = self.key(query, n, filter, namespace)
+            futures[key] = (future, (query, n, filter, namespace), version, started)
+            futures.move_to_end(key)
+            while len(futures) > self.max_queries:
+                futures.popitem(last=False)
+        return future
+
+    def request(self, memory: Memory, query: str, n: int, filter: dict = None, namespace: str = None) -> Future:
+        """The pending or finished prefetch for these arguments, started now if there is none."""
+        with self.lock:
+            entry = self.entries.get(memory, {}).get(self.key(query, n, filter, namespace))
+        if entry is not None:
+            future, _, version, started = entry
+            if version == memory.version and time.monotonic() - started < self.ttl:
+                return future
+        return self.prefetch(memory, query, n, filter, namespace)
+
+    def get(self, memory: Memory, query: str, n: int, filter: dict = None, namespace: str = None) -> list:
+        future = self.request(memory, query, n, filter, namespace)
         try:
-            if model == 'gpt-3.5-turbo' or model == 'gpt-4o-mini':
-                client = OpenAI()
-                messages = [{"role": "system", "content": prompt}]
-                response = client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                    temperature=temperature,
-                    max_tokens=max_tokens,
-                    n=1,
-                    stop=["OUTPUT", ],
-                )
-                return response.choices[0].message.content.strip()
-            elif model.startswith("rwkv"):
-                # Use proxy.
-                if not openai.proxies: raise Exception("No proxy set")
-                messages = [{"role": "system", "content": prompt}]
-                response = client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                    temperature=temperature,
-                    max_tokens=max_tokens,
-                    n=1,
-                    stop=["OUTPUT", ],
-                )
-                return response.choices[0].message.content.strip()
-            elif model.startswith("llama"):
-                # Spawn a subprocess to run llama.cpp
-                cmd = ["llama/main", "-p", prompt]
-                result = subprocess.run(cmd, shell=True, stderr=subprocess.DEVNULL, stdout=subprocess.PIPE, text=True)
-                return result.stdout.strip()
-            else:
-                raise Exception(f"Unknown model {model}")
-        except openai.RateLimitError:
-            print("Rate limit error, sleeping for 10 seconds...")
-            time.sleep(10)
-        except openai.APIError:
-            print("Service unavailable error, sleeping for 10 seconds...")
-            time.sleep(10)
+            return future.result()
+        except Exception:
+            # Don't keep serving a failed retrieval.
+            with self.lock:
+                futures = self.entries.get(memory, {})
+                key = self.key(query, n, filter, namespace)
+                if key in futures and futures[key][0] is future:
+                    del futures[key]
+            raise
+
+    def refresh(self, memory: Memory) -> None:
+        with self.lock:
+            queries = [entry[1] for entry in self.entries.get(memory, {}).values()]
+        for args in queries:
+            self.prefetch(memory, *args)
+
+
+context_prefetcher = ContextPrefetcher()
+
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+
+prompt_encodings = {}
+
+
+def prompt_encoding(model: str = None):
+    """The tiktoken encoding for a model, or None when tiktoken is not installed."""
+    if model not in prompt_encodings:
+        try:
+            import tiktoken
+            try:
+                prompt_encodings[model] = tiktoken.encoding_for_model(model or "gpt-3.5-turbo")
+            except KeyError:
+                prompt_encodings[model] = tiktoken.get_encoding("cl100k_base")
+        except ImportError:
+            if not any(encoding is None for encoding in prompt_encodings.values()):
+                print("tiktoken is not installed, estimating prompt sizes as 4 characters per token")
+            prompt_encodings[model] = None
+    return prompt_encodings[model]
+
+
+def count_tokens(text: str, model: str = None) -> int:
+    encoding = prompt_encoding(model)
+    if encoding is None:
+        # Roughly four characters per token for English text.
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int, model: str = None, keep: str = 'head') -> str:
+    """Cuts text to at most max_tokens, keeping its beginning ('head') or its end ('tail')."""
+    if max_tokens <= 0:
+        return ""
+    encoding = prompt_encoding(model)
+    if encoding is None:
+        if len(text) <= max_tokens * 4:
+            return text
+        return text[:max_tokens * 4] if keep == 'head' else text[-max_tokens * 4:]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens] if keep == 'head' else tokens[-max_tokens:])
+
+
+class PromptSection(NamedTuple):
+    """A variable part of a prompt template. value is a string, or a list rendered one item
+    per line whose trailing items are dropped first (e.g. context sorted best-first)."""
+    name: str
+    value: any
+    keep: str = 'head'
+
+
+def fit_prompt(template: str, sections: list, fixed: dict, max_tokens: int = None, model: str = None) -> str:
+    """Formats template so the whole prompt stays within max_tokens.
+
+    fixed values are used as-is. sections are given most important first: each takes what
+    it needs from the tokens the template and the earlier sections left over, and is
+    truncated to fit once the budget runs out.
+    """
+    max_tokens = max_tokens or PROMPT_TOKEN_BUDGET
+    empty = {section.name: "" for section in sections}
+    remaining = max_tokens - count_tokens(template.format(**fixed, **empty), model)
+
+    values = {}
+    for section in sections:
+        if isinstance(section.value, (list, tuple)):
+            items = []
+            for item in section.value:
+                item = str(item)
+                tokens = count_tokens(item, model) + 1
+                if tokens > remaining:
+                    break
+                items.append(item)
+                remaining -= tokens
+            values[section.name] = "\n".join(items)
         else:
-            break
+            text = str(section.value) if section.value is not None else ""
+            text = truncate_tokens(text, remaining, model, section.keep)
+            remaining -= count_tokens(text, model)
+            values[section.name] = text
+    return template.format(**fixed, **values)
+
+
+def prompt_field(field: str) -> str:
+    return re.split(r'[.\[]', field, maxsplit=1)[0]
+
+
+def template_segment(literal: str, field: str, format_spec: str, conversion: str) -> str:
+    text = literal.replace("{", "{{").replace("}", "}}")
+    if field is not None:
+        text += "{" + field + ("!" + conversion if conversion else "") + (":" + format_spec if format_spec else "") + "}"
+    return text
+
+
+def prompt_cache_value(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(prompt_cache_value(item) for item in value)
+    return value if isinstance(value, str) else repr(value)
+
+
+class CompiledPrompt:
+    """A prompt template split into a static prefix and a dynamic suffix.
+
+    The prefix is the template up to the first field that is not in static_fields (e.g.
+    the instructions, objective and tool specs). It is rendered once per distinct set of
+    static values and cached with its token count, so only the suffix is formatted and
+    measured on every call. List values in the prefix are rendered one item per line.
+    Sending the prefix as its own leading message (see chat_messages) keeps it
+    byte-identical across calls, which is what provider-side prompt caching keys on.
+    """
+
+    def __init__(self, template: str, static_fields: tuple = (), cache_size: int = 16):
+        segments = list(string.Formatter().parse(template))
+        split = next(
+            (i for i, (_, field, _, _) in enumerate(segments)
+             if field is not None and (not field or prompt_field(field) not in static_fields)),
+            len(segments)
+        )
+        prefix = segments[:split]
+        suffix = segments[split:]
+        if suffix:
+            # The literal text before the first dynamic field is still static.
+            literal, field, format_spec, conversion = suffix[0]
+            prefix = prefix + [(literal, None, None, None)]
+            suffix = [("", field, format_spec, conversion)] + suffix[1:]
+        self.prefix_template = "".join(template_segment(*segment) for segment in prefix)
+        self.suffix_template = "".join(template_segment(*segment) for segment in suffix)
+        self.prefix_fields = tuple(dict.fromkeys(prompt_field(field) for _, field, _, _ in prefix if field))
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def prefix_entry(self, values: dict) -> list:
+        key = tuple(prompt_cache_value(values[field]) for field in self.prefix_fields)
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is not None:
+                self.cache.move_to_end(key)
+                return entry
+        rendered = {
+            field: "\n".join(str(item) for item in values[field]) if isinstance(values[field], (list, tuple)) else values[field]
+            for field in self.prefix_fields
+        }
+        # [prefix text, {model: token count}]
+        entry = [self.prefix_template.format(**rendered), {}]
+        with self.lock:
+            self.cache[key] = entry
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return entry
+
+    def prefix(self, values: dict) -> str:
+        return self.prefix_entry(values)[0]
+
+    def prefix_tokens(self, values: dict, model: str = None) -> int:
+        entry = self.prefix_entry(values)
+        if model not in entry[1]:
+            entry[1][model] = count_tokens(entry[0], model)
+        return entry[1][model]
 
+    def render(self, values: dict) -> tuple:
+        """Returns (prefix, suffix)."""
+        return self.prefix(values), self.suffix_template.format(**values)
 
-def get_sorted_context(memory: Memory, query: str, n: int):
-    results = memory.query(query, n)
-    sorted_results = sorted(
-        results,
-        key=lambda x: x.similarity if getattr(x, 'similarity', None) else x.score,
-        reverse=True
+    def fit(self, sections: list, fixed: dict, max_tokens: int = None, model: str = None) -> tuple:
+        """Like fit_prompt, with the suffix fitted into what the cached prefix leaves of the budget."""
+        budget = (max_tokens or PROMPT_TOKEN_BUDGET) - self.prefix_tokens(fixed, model)
+        return self.prefix(fixed), fit_prompt(self.suffix_template, sections, fixed, max(budget, 1), model)
+
+
+@functools.lru_cache(maxsize=64)
+def compile_prompt(template: str, static_fields: tuple = ()) -> CompiledPrompt:
+    return CompiledPrompt(template, static_fields)
+
+
+def build_executor_prompt(prompt: str, objective: str, task: dict, tools: list, memory: Memory,
+                          context_filter: dict = None, namespace: str = None, token_budget: int = None,
+                          model: str = None) -> tuple:
+    """Returns the (static prefix, dynamic suffix) of the executor prompt."""
+    compiled = compile_prompt(prompt if prompt is not None else DEFAULT_EXECUTOR_PROMPT, ('objective', 'tools'))
+
+    # Usually already prefetched by ToolRunner, otherwise retrieved while the scratch pad is read.
+    context_prefetcher.request(memory, query=objective, n=5, filter=context_filter, namespace=namespace)
+
+    scratch_pad = ""
+
+    for tool in tools:
+        if tool['name'] == 'scratch-pad':
+            file_name = tool['instance'].file_name.value
+            with open(file_name, "r") as f:
+                scratch_pad += f.read()
+
+    context = context_prefetcher.get(memory, query=objective, n=5, filter=context_filter, namespace=namespace)
+
+    print("\n*******RELEVANT CONTEXT******\n")
+    print(context)
+
+    print("\n*******SCRATCH PAD******\n")
+    print(scratch_pad)
+
+    # The task is filled in first, then the most relevant context, then the scratch pad.
+    return compiled.fit(
+        [
+            PromptSection("task", task),
+            PromptSection("context", context),
+            # The newest notes are at the end of the scratch pad.
+            PromptSection("scratch_pad", scratch_pad, keep='tail'),
+        ],
+        {"objective": objective, "tools": [tool['spec'].strip() for tool in tools]},
+        token_budget,
+        model
     )
-    return [(str(item.attributes['task']) + ":" + str(item.attributes['result'])) for item in sorted_results]
+
+
+def run_action_tools(action: str, tools: list) -> str:
+    """Runs every TOOL block of a complete action and returns the action followed by their outputs."""
+    result = action + "\n"
+    for tool in action.split("TOOL: "):
+        result += run_tool(tool, tools.copy())
+    return result
+
+
+async def async_run_action_tools(action: str, tools: list) -> str:
+    result = action + "\n"
+    for tool in action.split("TOOL: "):
+        result += await async_run_tool(tool, tools.copy())
+    return result
+
+
+def store_task_result(memory: Memory, task: dict, result: str, namespace: str = None) -> None:
+    kwargs = {'namespace': namespace} if namespace is not None else {}
+    memory.add(
+        f"result_{task['task_id']}",
+        result,
+        {
+            "task_id": task['task_id'],
+            "task": task['task_name'],
+            "result": result
+        },
+        **kwargs
+    )
+    # Start retrieving the next task's context while the creator and prioritizer run.
+    context_prefetcher.refresh(memory)
 
 
 def extract_task_number(task_id, task_list):
@@ -157,6 +1129,106 @@ def extract_task_number(task_id, task_list):
         return len(task_list) + 1
 
 
+TASK_LIST_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "tasks": {"type": "array", "items": {"type": "string"}}
+    },
+    "required": ["tasks"],
+    "additionalProperties": False
+}
+
+STRUCTURED_TASKS_INSTRUCTION = """
+Respond with only a JSON object of the form {"tasks": ["first task", "second task"]},
+listing each task description once, in order, without numbering."""
+
+TASK_REPAIR_PROMPT = """
+The following response should have been a JSON object of the form {{"tasks": ["first task", "second task"]}},
+but it could not be used: {error}.
+Respond with only the corrected JSON object, keeping the same tasks in the same order.
+Response:
+{response}
+"""
+
+# Prefixes of models that accept a strict JSON schema response format; other OpenAI chat
+# models get JSON object mode, and local models rely on the instruction alone.
+JSON_SCHEMA_MODELS = ("gpt-4o", "gpt-4.1", "gpt-5", "o1", "o3", "o4")
+
+
+def structured_response_format(model: str, name: str, schema: dict):
+    if model.startswith(JSON_SCHEMA_MODELS):
+        return {"type": "json_schema", "json_schema": {"name": name, "schema": schema, "strict": True}}
+    if model.startswith("gpt-"):
+        return {"type": "json_object"}
+    return None
+
+
+def extract_json(text: str) -> str:
+    """The outermost JSON object or array in text, e.g. inside a markdown code block."""
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        return text
+    start = min(starts)
+    end = text.rfind("}" if text[start] == "{" else "]")
+    return text[start:end + 1] if end > start else text
+
+
+def parse_task_names(response: str) -> list:
+    """Task descriptions from a {"tasks": [...]} response. Raises ValueError if it doesn't match."""
+    try:
+        data = json.loads(response)
+    except ValueError:
+        data = json.loads(extract_json(response))
+    if isinstance(data, dict):
+        data = data.get("tasks")
+    if not isinstance(data, list):
+        raise ValueError('expected a "tasks" array')
+    names = []
+    for item in data:
+        if isinstance(item, dict):
+            item = item.get("task_name")
+        if not isinstance(item, str):
+            raise ValueError(f"expected task descriptions to be strings, got {item!r}")
+        item = item.strip()
+        if item and item not in names:
+            names.append(item)
+    return names
+
+
+def structured_task_names(model: str, prompt: str, prefix: str = None, retry_policy: RetryPolicy = None,
+                          max_repairs: int = 1):
+    """Asks for a JSON task list and parses it strictly, with up to max_repairs repair calls.
+    Returns None if no valid list was produced."""
+    response_format = structured_response_format(model, "task_list", TASK_LIST_SCHEMA)
+    response = llm_call(model, prompt + STRUCTURED_TASKS_INSTRUCTION, retry_policy=retry_policy,
+                        prefix=prefix, response_format=response_format)
+    for attempt in range(max_repairs + 1):
+        try:
+            return parse_task_names(response)
+        except ValueError as e:
+            print(f"Invalid task list ({e}): {response}")
+            if attempt == max_repairs:
+                return None
+            response = llm_call(model, TASK_REPAIR_PROMPT.format(error=e, response=response), 0.0,
+                                retry_policy=retry_policy, response_format=response_format)
+
+
+async def async_structured_task_names(model: str, prompt: str, prefix: str = None, retry_policy: RetryPolicy = None,
+                                      max_repairs: int = 1):
+    response_format = structured_response_format(model, "task_list", TASK_LIST_SCHEMA)
+    response = await async_llm_call(model, prompt + STRUCTURED_TASKS_INSTRUCTION, retry_policy=retry_policy,
+                                    prefix=prefix, response_format=response_format)
+    for attempt in range(max_repairs + 1):
+        try:
+            return parse_task_names(response)
+        except ValueError as e:
+            print(f"Invalid task list ({e}): {response}")
+            if attempt == max_repairs:
+                return None
+            response = await async_llm_call(model, TASK_REPAIR_PROMPT.format(error=e, response=response), 0.0,
+                                            retry_policy=retry_policy, response_format=response_format)
+
+
 @xai_component
 class TaskCreatorAgent(Component):
     """Creates new tasks based on given model, prompt, and objectives.
@@ -168,6 +1240,9 @@ class TaskCreatorAgent(Component):
     - result: Result of the previous tasks.
     - task: Current task information.
     - task_list: List of all tasks.
+    - retry_policy: Optional retry policy for the LLM call.
+    - structured: Ask for a JSON task list and parse it strictly instead of splitting lines.
+    - max_repairs: With `structured`, how many times an invalid response is sent back for repair. Defaults to 1.
 
     #### outPorts:
     - new_tasks: list of newly created tasks.
@@ -179,12 +1254,36 @@ class TaskCreatorAgent(Component):
     result: InArg[str]
     task: InArg[dict]
     task_list: InArg[str]
+    retry_policy: InArg[RetryPolicy]
+    structured: InArg[bool]
+    max_repairs: InArg[int]
     new_tasks: OutArg[list]
 
     def execute(self, ctx) -> None:
+        prefix, prompt = self.build_prompt()
+        if self.structured.value:
+            names = structured_task_names(self.model.value, prompt, prefix, self.retry_policy.value, self.repairs())
+            self.handle_tasks(names or [])
+            return
+        response = llm_call(self.model.value, prompt, retry_policy=self.retry_policy.value, prefix=prefix)
+        self.handle_response(response)
+
+    async def execute_async(self, ctx) -> None:
+        prefix, prompt = self.build_prompt()
+        if self.structured.value:
+            names = await async_structured_task_names(self.model.value, prompt, prefix, self.retry_policy.value, self.repairs())
+            self.handle_tasks(names or [])
+            return
+        response = await async_llm_call(self.model.value, prompt, retry_policy=self.retry_policy.value, prefix=prefix)
+        self.handle_response(response)
+
+    def repairs(self) -> int:
+        return self.max_repairs.value if self.max_repairs.value is not None else 1
+
+    def build_prompt(self) -> tuple:
         text = self.prompt.value if self.prompt.value is not None else DEFAULT_TASK_CREATOR_PROMPT
 
-        prompt = text.format(**{
+        return compile_prompt(text, ('objective',)).render({
             "objective": self.objective.value,
             "result": self.result.value,
             "task": self.task.value,
@@ -192,12 +1291,14 @@ class TaskCreatorAgent(Component):
             "task_list": self.task_list.value
         })
 
-        response = llm_call(self.model.value, prompt)
-        new_tasks = response.split('\n')
+    def handle_response(self, response: str) -> None:
+        self.handle_tasks(response.split('\n'))
+
+    def handle_tasks(self, new_tasks: list) -> None:
         print("New tasks: ", new_tasks)
 
         task_id = self.task.value["task_id"]
-        task_id_counter = extract_task_number(task_id, self.task_list)
+        task_id_counter = extract_task_number(task_id, self.task_list.value)
         ret = []
         for task_name in new_tasks:
             task_id_counter += 1
@@ -211,9 +1312,13 @@ class TaskPrioritizerAgent(Component):
 
     #### inPorts:
     - objective: Objective for task prioritization.
-    - prompt: Prompt string for the AI model.
+    - prompt: Prompt string for the AI model. Defaults to a numbered-list prompt, or a format-free one with `structured`.
     - model: AI model used for task prioritization.
     - task_list: List of all tasks.
+    - retry_policy: Optional retry policy for the LLM call.
+    - structured: Ask for a JSON task list and parse it strictly instead of parsing numbered lines.
+      Task ids are then assigned as integers from the next free id.
+    - max_repairs: With `structured`, how many times an invalid response is sent back for repair. Defaults to 1.
 
     #### outPorts:
     - prioritized_tasks: Prioritized list of tasks.
@@ -223,17 +1328,48 @@ class TaskPrioritizerAgent(Component):
     prompt: InArg[str]
     model: InArg[str]
     task_list: InArg[list]
+    retry_policy: InArg[RetryPolicy]
+    structured: InArg[bool]
+    max_repairs: InArg[int]
     prioritized_tasks: OutArg[deque]
 
     def execute(self, ctx) -> None:
-        text = self.prompt.value if self.prompt.value is not None else DEFAULT_TASK_PRIORITIZER_PROMPT
-        prompt = text.format(**{
+        prefix, prompt = self.build_prompt()
+        if self.structured.value:
+            names = structured_task_names(self.model.value, prompt, prefix, self.retry_policy.value, self.repairs())
+            self.handle_tasks(names)
+            return
+        response = llm_call(self.model.value, prompt, retry_policy=self.retry_policy.value, prefix=prefix)
+        self.handle_response(response)
+
+    async def execute_async(self, ctx) -> None:
+        prefix, prompt = self.build_prompt()
+        if self.structured.value:
+            names = await async_structured_task_names(self.model.value, prompt, prefix, self.retry_policy.value, self.repairs())
+            self.handle_tasks(names)
+            return
+        response = await async_llm_call(self.model.value, prompt, retry_policy=self.retry_policy.value, prefix=prefix)
+        self.handle_response(response)
+
+    def repairs(self) -> int:
+        return self.max_repairs.value if self.max_repairs.value is not None else 1
+
+    def next_task_id(self) -> int:
+        return max([int(t["task_id"]) for t in self.task_list.value]) + 1
+
+    def build_prompt(self) -> tuple:
+        if self.prompt.value is not None:
+            text = self.prompt.value
+        else:
+            text = DEFAULT_STRUCTURED_TASK_PRIORITIZER_PROMPT if self.structured.value else DEFAULT_TASK_PRIORITIZER_PROMPT
+        return compile_prompt(text, ('objective',)).render({
             "objective": self.objective.value,
             "task_list": self.task_list.value,
             "task_names": [t["task_name"] for t in self.task_list.value],
-            "next_task_id": max([int(t["task_id"]) for t in self.task_list.value]) + 1
+            "next_task_id": self.next_task_id()
         })
-        response = llm_call(self.model.value, prompt)
+
+    def handle_response(self, response: str) -> None:
         new_tasks = response.split('\n')
         task_list = deque()
         for task_string in new_tasks:
@@ -246,6 +1382,20 @@ class TaskPrioritizerAgent(Component):
         print(f"New tasks: {new_tasks}")
         self.prioritized_tasks.value = task_list
 
+    def handle_tasks(self, names) -> None:
+        if names is None:
+            # Keep the current order rather than losing tasks to an unusable response.
+            print("Could not prioritize the tasks, keeping them as they are")
+            self.prioritized_tasks.value = deque(
+                {"task_id": int(t["task_id"]), "task_name": t["task_name"]} for t in self.task_list.value
+            )
+            return
+        next_task_id = self.next_task_id()
+        print(f"New tasks: {names}")
+        self.prioritized_tasks.value = deque(
+            {"task_id": next_task_id + i, "task_name": name} for i, name in enumerate(names)
+        )
+
 
 @xai_component
 class TaskExecutorAgent(Component):
@@ -258,9 +1408,15 @@ class TaskExecutorAgent(Component):
     - tasks: Queue of tasks to be executed.
     - tools: List of tools available for task execution.
     - memory: Memory context for task execution.
+    - retry_policy: Optional retry policy for the LLM call.
+    - stream: Stream the completion through `action_stream` instead of waiting for the whole action.
+    - namespace: Optional memory namespace to retrieve context from, e.g. one per objective.
+    - context_filter: Optional metadata filter for context retrieval, e.g. {"task_id": {"$gte": 3}}.
+    - token_budget: Maximum prompt size in tokens. Context and scratch pad are truncated to fit. Defaults to PROMPT_TOKEN_BUDGET.
 
     #### outPorts:
     - action: Executed action.
+    - action_stream: Iterator of action chunks when `stream` is set, connect it to ToolRunner.
     - task: Task information.
     """
 
@@ -270,42 +1426,55 @@ class TaskExecutorAgent(Component):
     tasks: InArg[deque]
     tools: InArg[list]
     memory: InArg[any]
+    retry_policy: InArg[RetryPolicy]
+    stream: InArg[bool]
+    namespace: InArg[str]
+    context_filter: InArg[dict]
+    token_budget: InArg[int]
     action: OutArg[str]
+    action_stream: OutArg[any]
     task: OutArg[dict]
 
     def execute(self, ctx) -> None:
-        text = self.prompt.value if self.prompt.value is not None else DEFAULT_EXECUTOR_PROMPT
-
         task = self.tasks.value.popleft()
         print(f"Next Task: {task}")
-        context = get_sorted_context(self.memory.value, query=self.objective.value, n=5)
-
-        print("\n*******RELEVANT CONTEXT******\n")
-        print(context)
-
-        scratch_pad = ""
-
-        for tool in self.tools.value:
-            if tool['name'] == 'scratch-pad':
-                file_name = tool['instance'].file_name.value
-                with open(file_name, "r") as f:
-                    scratch_pad += f.read()
-
-        print("\n*******SCRATCH PAD******\n")
-        print(scratch_pad)
+        prefix, prompt = self.build_prompt(task)
+        if self.stream.value:
+            self.action.value = None
+            self.action_stream.value = llm_stream(
+                self.model.value, prompt, 0.7, 2000, retry_policy=self.retry_policy.value, prefix=prefix
+            )
+            self.task.value = task
+            return
+        result = llm_call(self.model.value, prompt, 0.7, 2000, retry_policy=self.retry_policy.value, prefix=prefix)
+        self.handle_response(task, result)
 
-        prompt = text.format(**{
-            "scratch_pad": scratch_pad,
-            "objective": self.objective.value,
-            "context": context,
-            "task": self.task.value,
-            "tools": [tool['spec'] for tool in self.tools.value]
-        })
-        result = llm_call(self.model.value, prompt, 0.7, 2000)
+    async def execute_async(self, ctx) -> None:
+        task = self.tasks.value.popleft()
+        print(f"Next Task: {task}")
+        # Context retrieval and the scratch pad read are blocking, keep them off the event loop.
+        prefix, prompt = await asyncio.to_thread(self.build_prompt, task)
+        result = await async_llm_call(self.model.value, prompt, 0.7, 2000, retry_policy=self.retry_policy.value, prefix=prefix)
+        self.handle_response(task, result)
+
+    def build_prompt(self, task: dict) -> tuple:
+        return build_executor_prompt(
+            self.prompt.value,
+            self.objective.value,
+            task,
+            self.tools.value,
+            self.memory.value,
+            self.context_filter.value,
+            self.namespace.value,
+            self.token_budget.value,
+            self.model.value
+        )
 
+    def handle_response(self, task: dict, result: str) -> None:
         print(f"Result:\n{result}")
 
         self.action.value = result
+        self.action_stream.value = None
         self.task.value = task
 
 
@@ -321,6 +1490,10 @@ class TaskCriticAgent(Component):
     - tools: The list of tools available for task critique.
     - action: The executed action that is to be critiqued.
     - task: The current task information.
+    - retry_policy: Optional retry policy for the LLM call.
+    - namespace: Optional memory namespace to retrieve context from.
+    - context_filter: Optional metadata filter for context retrieval.
+    - token_budget: Maximum prompt size in tokens. Context is truncated to fit. Defaults to PROMPT_TOKEN_BUDGET.
 
     #### outPorts:
     - updated_action: The updated action after the model's critique.
@@ -333,24 +1506,49 @@ class TaskCriticAgent(Component):
     tools: InArg[list]
     action: InArg[str]
     task: InArg[dict]
+    retry_policy: InArg[RetryPolicy]
+    namespace: InArg[str]
+    context_filter: InArg[dict]
+    token_budget: InArg[int]
     updated_action: OutArg[str]
 
     def execute(self, ctx) -> None:
-        text = self.prompt.value if self.prompt.value is not None else DEFAULT_CRITIC_PROMPT
+        print(f"Task: {self.task.value}")
+        prefix, prompt = self.build_prompt()
+        new_action = llm_call(self.model.value, prompt, 0.7, 2000, retry_policy=self.retry_policy.value, prefix=prefix)
+        self.handle_response(new_action)
 
+    async def execute_async(self, ctx) -> None:
         print(f"Task: {self.task.value}")
+        prefix, prompt = await asyncio.to_thread(self.build_prompt)
+        new_action = await async_llm_call(self.model.value, prompt, 0.7, 2000, retry_policy=self.retry_policy.value, prefix=prefix)
+        self.handle_response(new_action)
+
+    def build_prompt(self) -> tuple:
+        text = self.prompt.value if self.prompt.value is not None else DEFAULT_CRITIC_PROMPT
 
-        context = get_sorted_context(self.memory.value, query=self.objective.value, n=5)
+        # Same arguments as the executor, so this reuses the context it retrieved for the task.
+        context = context_prefetcher.get(
+            self.memory.value,
+            query=self.objective.value,
+            n=5,
+            filter=self.context_filter.value,
+            namespace=self.namespace.value
+        )
         print("Context: ", context)
 
-        prompt = text.format(**{
-            "objective": self.objective.value,
-            "context": context,
-            "action": self.action.value,
-            "task": self.task.value
-        })
-        new_action = llm_call(self.model.value, prompt, 0.7, 2000)
+        # The action is never truncated: a cut-off tool block returned as-is would be run by ToolRunner.
+        return compile_prompt(text, ('objective',)).fit(
+            [
+                PromptSection("task", self.task.value),
+                PromptSection("context", context),
+            ],
+            {"objective": self.objective.value, "action": self.action.value},
+            self.token_budget.value,
+            self.model.value
+        )
 
+    def handle_response(self, new_action: str) -> None:
         print(f"New action: {new_action}")
 
         # If the model responds without a new TOOL prompt use the original.
@@ -365,39 +1563,156 @@ class ToolRunner(Component):
 
     #### inPorts:
     - action: The action that determines which tool should be executed.
+    - action_stream: Optional streamed action from TaskExecutorAgent. Each tool runs as soon as its block is complete.
     - memory: The current context memory, used for updating the result of tool execution.
     - task: The current task information.
     - tools: The list of tools available for execution.
+    - namespace: Optional memory namespace to store the result in.
 
     #### outPorts:
     - result: The result after running the tool.
     """
 
     action: InArg[str]
+    action_stream: InArg[any]
     memory: InCompArg[Memory]
     task: InArg[dict]
     tools: InArg[list]
+    namespace: InArg[str]
     result: OutArg[str]
 
     def execute(self, ctx) -> None:
-        tools = self.action.value.split("TOOL: ")
-        result = self.action.value + "\n"
-        for tool in tools:
-            result += run_tool(tool, self.tools.value.copy())
-
-        task = self.task.value
-        self.memory.value.add(
-            f"result_{task['task_id']}",
-            result,
-            {
-                "task_id": task['task_id'],
-                "task": task['task_name'],
-                "result": result
-            }
-        )
+        if self.action_stream.value is not None:
+            result = self.run_stream(self.action_stream.value)
+        else:
+            result = run_action_tools(self.action.value, self.tools.value)
+
+        store_task_result(self.memory.value, self.task.value, result, self.namespace.value)
+        self.result.value = result
+
+    async def execute_async(self, ctx) -> None:
+        if self.action_stream.value is not None:
+            # The stream is a blocking iterator, so it is consumed on a worker thread.
+            result = await asyncio.to_thread(self.run_stream, self.action_stream.value)
+        else:
+            result = await async_run_action_tools(self.action.value, self.tools.value)
 
+        # Embedding the result and writing it are blocking calls.
+        await asyncio.to_thread(store_task_result, self.memory.value, self.task.value, result, self.namespace.value)
         self.result.value = result
 
+    def run_stream(self, chunks) -> str:
+        parser = ToolBlockParser()
+        action = ""
+        outputs = ""
+        for chunk in chunks:
+            action += chunk
+            for block in parser.feed(chunk):
+                outputs += run_tool(block, self.tools.value.copy())
+        for block in parser.finish():
+            outputs += run_tool(block, self.tools.value.copy())
+
+        print(f"Result:\n{action}")
+        return action.strip() + "\n" + outputs
+
+
+@xai_component
+class ConcurrentTaskExecutor(Component):
+    """Executes several tasks from the queue at once and stores each result in memory as it completes.
+    Replaces TaskExecutorAgent and ToolRunner when the queued tasks are independent of each other.
+
+    LLM calls run in parallel up to `max_concurrency`. Tools run one at a time on a dedicated
+    thread, as browser sessions and database connections are not safe to share across threads.
+
+    #### inPorts:
+    - objective: Objective for task execution.
+    - prompt: Prompt string for the AI model.
+    - model: AI model used for task execution.
+    - tasks: Queue of tasks, e.g. from TaskPrioritizerAgent. Executed tasks are removed from it.
+    - tools: List of tools available for task execution.
+    - memory: Memory the results are stored in and context is retrieved from.
+    - max_concurrency: Maximum number of tasks executed at the same time. Defaults to 4.
+    - max_tasks: Maximum number of tasks taken from the queue. Defaults to max_concurrency.
+    - requests_per_minute: Optional request rate limit for the model, shared by every call to it in this process.
+    - retry_policy: Optional retry policy for the LLM calls.
+    - namespace: Optional memory namespace for context and results.
+    - context_filter: Optional metadata filter for context retrieval.
+    - token_budget: Maximum prompt size in tokens. Defaults to PROMPT_TOKEN_BUDGET.
+
+    #### outPorts:
+    - results: List of {"task", "action", "result"} dicts in completion order. Failed tasks have an "error" instead and are put back on the queue.
+    - task: The last completed task.
+    - result: The result of the last completed task.
+    """
+
+    objective: InCompArg[str]
+    prompt: InArg[str]
+    model: InArg[str]
+    tasks: InArg[deque]
+    tools: InArg[list]
+    memory: InCompArg[Memory]
+    max_concurrency: InArg[int]
+    max_tasks: InArg[int]
+    requests_per_minute: InArg[float]
+    retry_policy: InArg[RetryPolicy]
+    namespace: InArg[str]
+    context_filter: InArg[dict]
+    token_budget: InArg[int]
+    results: OutArg[list]
+    task: OutArg[dict]
+    result: OutArg[str]
+
+    def execute(self, ctx) -> None:
+        max_concurrency = self.max_concurrency.value or 4
+        max_tasks = self.max_tasks.value or max_concurrency
+        if self.requests_per_minute.value:
+            set_rate_limit(self.model.value, self.requests_per_minute.value)
+
+        pending = self.tasks.value
+        tasks = [pending.popleft() for _ in range(min(max_tasks, len(pending)))]
+        print(f"Next Tasks: {tasks}")
+
+        results = []
+        with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="task-executor") as executor, \
+                ThreadPoolExecutor(max_workers=1, thread_name_prefix="task-tools") as tool_thread:
+            futures = {executor.submit(self.run_task, task, tool_thread): task for task in tasks}
+            failed = []
+            for future in as_completed(futures):
+                task = futures[future]
+                try:
+                    action, result = future.result()
+                    store_task_result(self.memory.value, task, result, self.namespace.value)
+                except Exception as e:
+                    print(f"Task {task['task_id']} failed: {e}")
+                    failed.append(task)
+                    results.append({"task": task, "action": None, "result": None, "error": str(e)})
+                    continue
+                results.append({"task": task, "action": action, "result": result})
+                print(f"Completed Task {task['task_id']}:\n{result}")
+
+        # Failed tasks go back to the front of the queue, in their original order, to be retried.
+        pending.extendleft(reversed([task for task in tasks if task in failed]))
+
+        completed = [entry for entry in results if "error" not in entry]
+        self.results.value = results
+        self.task.value = completed[-1]["task"] if completed else None
+        self.result.value = completed[-1]["result"] if completed else None
+
+    def run_task(self, task: dict, tool_thread: ThreadPoolExecutor):
+        prefix, prompt = build_executor_prompt(
+            self.prompt.value,
+            self.objective.value,
+            task,
+            self.tools.value,
+            self.memory.value,
+            self.context_filter.value,
+            self.namespace.value,
+            self.token_budget.value,
+            self.model.value
+        )
+        action = llm_call(self.model.value, prompt, 0.7, 2000, retry_policy=self.retry_policy.value, prefix=prefix)
+        return action, tool_thread.submit(run_action_tools, action, self.tools.value).result()
+
 
 @xai_component
 class CreateTaskList(Component):
@@ -436,24 +1751,185 @@ INSERT INTO points (x, y) VALUES (783, 848);
 SELECT * FROM points;
 ```
 sqlite OUTPUT:
-[(783, 848)]
+OK
+OK, 1 row changed
+x | y
+783 | 848
 """
 
+class SqliteConnectionPool:
+    """Long-lived connections to one SQLite database, shared by every SqliteTool using it.
+
+    Connections are opened on demand up to `size` and handed to one thread at a time, so
+    concurrent agents never share a connection. They run in autocommit mode with WAL
+    journaling and synchronous=NORMAL, so a batch committed as one transaction costs a
+    single WAL append instead of an fsync per statement, and readers don't block writers.
+    An in-memory database is private to its connection, so it gets a pool of one.
+    """
+
+    def __init__(self, path: str, size: int = 4, busy_timeout: float = 5.0, wal: bool = True):
+        self.path = path
+        self.size = 1 if path == ":memory:" or not path else size
+        self.busy_timeout = busy_timeout
+        self.wal = wal
+        self.idle = queue.LifoQueue()
+        self.opened = 0
+        self.lock = threading.Lock()
+
+    def connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None, check_same_thread=False)
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout * 1000)}")
+        if self.wal and self.path != ":memory:":
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        with self.lock:
+            if self.idle.empty() and self.opened < self.size:
+                self.opened += 1
+                open_new = True
+            else:
+                open_new = False
+        if open_new:
+            try:
+                return self.connect()
+            except Exception:
+                with self.lock:
+                    self.opened -= 1
+                raise
+        return self.idle.get()
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        if conn.in_transaction:
+            conn.rollback()
+        self.idle.put(conn)
+
+    def close(self) -> None:
+        while not self.idle.empty():
+            self.idle.get_nowait().close()
+            with self.lock:
+                self.opened -= 1
+
+
+sqlite_pools = {}
+sqlite_pools_lock = threading.Lock()
+
+
+def get_sqlite_pool(path: str, size: int = 4, busy_timeout: float = 5.0, wal: bool = True) -> SqliteConnectionPool:
+    key = path if path == ":memory:" else os.path.abspath(path)
+    with sqlite_pools_lock:
+        pool = sqlite_pools.get(key)
+        if pool is None:
+            pool = sqlite_pools[key] = SqliteConnectionPool(path, size, busy_timeout, wal)
+        return pool
+
+
+SQL_TOKEN = re.compile(r"--[^\n]*|/\*.*?(?:\*/|$)|'(?:[^']|'')*'?|\"(?:[^\"]|\"\")*\"?|[^-/'\"]+|.", re.DOTALL)
+
+
+def strip_sql_comments(sql: str) -> str:
+    """sql without its -- and /* */ comments, leaving literals that contain them alone."""
+    return "".join(token for token in SQL_TOKEN.findall(sql) if not token.startswith(("--", "/*")))
+
+
+def split_sql(script: str) -> list:
+    """Splits a script into complete statements, keeping semicolons inside literals.
+    Chunks holding only comments are dropped."""
+    statements = []
+    current = ""
+    for piece in script.split(";"):
+        current += piece + ";"
+        if sqlite3.complete_statement(current):
+            if strip_sql_comments(current).strip(" \t\r\n;"):
+                statements.append(current.strip().rstrip(";"))
+            current = ""
+    if strip_sql_comments(current).strip(" \t\r\n;"):
+        statements.append(current.strip().rstrip(";"))
+    return statements
+
+
+def sql_cell(value, max_chars: int) -> str:
+    if value is None:
+        return "NULL"
+    if isinstance(value, bytes):
+        return f"<{len(value)} bytes>"
+    text = str(value).replace("\n", "\\n")
+    return text if len(text) <= max_chars else text[:max_chars] + "..."
+
+
+def render_cursor(cursor: sqlite3.Cursor, max_rows: int = 50, max_chars: int = 4000, max_cell: int = 200,
+                  count_limit: int = 100000) -> str:
+    """Renders a query result as a header line and one line per row, streaming from the cursor.
+
+    Stops after max_rows rows or max_chars characters. The rows left over are counted (up to
+    count_limit) without being kept, so memory use doesn't depend on the result size.
+    """
+    if cursor.description is None:
+        return "OK" if cursor.rowcount < 0 else f"OK, {cursor.rowcount} row{'' if cursor.rowcount == 1 else 's'} changed"
+
+    lines = [" | ".join(column[0] for column in cursor.description)]
+    size = len(lines[0])
+    omitted = 0
+    for row in cursor:
+        if len(lines) - 1 >= max_rows or size >= max_chars:
+            omitted = 1
+            break
+        line = " | ".join(sql_cell(value, max_cell) for value in row)
+        lines.append(line)
+        size += len(line) + 1
+    if omitted:
+        for _ in cursor:
+            if omitted >= count_limit:
+                break
+            omitted += 1
+        lines.append(f"... {omitted}{'+' if omitted >= count_limit else ''} more row{'' if omitted == 1 else 's'} omitted")
+    elif len(lines) == 1:
+        lines.append("(no rows)")
+    return "\n".join(lines)
+
+
+SQL_TRANSACTION_CONTROL = re.compile(r'^\s*(BEGIN|COMMIT|END|ROLLBACK|SAVEPOINT|RELEASE)\b', re.IGNORECASE)
+SQL_MAY_RETURN_ROWS = re.compile(r'^\s*(SELECT|WITH|PRAGMA|EXPLAIN|VALUES)\b|\bRETURNING\b', re.IGNORECASE)
+
+
 @xai_component
 class SqliteTool(Component):
     """Component that performs SQL queries against an SQLite database.
 
+    The connections are pooled per database path and kept open between tool runs. Each
+    block of statements runs as one transaction that a failing statement rolls back.
+    Query results are streamed from the cursor and rendered as a bounded table.
+
     #### inPorts:
     - path: The path to the SQLite database.
+    - busy_timeout: Seconds to wait for a lock held by another connection. Defaults to 5.
+    - pool_size: Maximum number of open connections to the database. Defaults to 4.
+    - wal: Use write-ahead logging. Defaults to True.
+    - max_rows: Maximum number of rows shown per query. Defaults to 50.
+    - max_chars: Maximum size of a query result in characters. Defaults to 4000.
+    - explain: Prefix each query result with its EXPLAIN QUERY PLAN.
 
     #### outPorts:
     - tool_spec: The specification of the SQLite tool, including its capabilities and requirements.
     """
 
     path: InArg[str]
+    busy_timeout: InArg[float]
+    pool_size: InArg[int]
+    wal: InArg[bool]
+    max_rows: InArg[int]
+    max_chars: InArg[int]
+    explain: InArg[bool]
     tool_spec: OutArg[dict]
 
     def execute(self, ctx) -> None:
+        self.pool = get_sqlite_pool(
+            self.path.value,
+            size=self.pool_size.value or 4,
+            busy_timeout=self.busy_timeout.value if self.busy_timeout.value is not None else 5.0,
+            wal=self.wal.value if self.wal.value is not None else True
+        )
         if not 'tools' in ctx:
             ctx['tools'] = {}
         spec = {
@@ -487,24 +1963,56 @@ class SqliteTool(Component):
         if not any:
             for line in lines[1:]:
                 code.append(line + "\n")
-        conn = sqlite3.connect(self.path.value)
-        
-        all_queries = "\n".join(code)
-        queries = all_queries.split(";")
+
+        conn = self.pool.acquire()
+        try:
+            return self.run_statements(conn, split_sql("".join(code)))
+        finally:
+            self.pool.release(conn)
+
+    def run_statements(self, conn: sqlite3.Connection, statements: list) -> str:
+        # Blocks that manage their own transactions run statement by statement in autocommit mode.
+        batched = not any(SQL_TRANSACTION_CONTROL.match(statement) for statement in statements)
         res = ""
+        executed = 0
         try:
-            for query in queries:
-                res += str(conn.execute(query).fetchall())
-                res += "\n"
+            if batched and not any(SQL_MAY_RETURN_ROWS.search(statement) for statement in statements):
+                # Nothing to report per statement, let SQLite run the whole block in one call.
+                conn.executescript("BEGIN;\n" + "\n;\n".join(statements) + "\n;\nCOMMIT;")
+                res += f"OK, {len(statements)} statement{'' if len(statements) == 1 else 's'} executed\n"
+            else:
+                if batched:
+                    conn.execute("BEGIN")
+                for statement in statements:
+                    if self.explain.value and SQL_MAY_RETURN_ROWS.search(statement) \
+                            and not re.match(r'\s*(PRAGMA|EXPLAIN)\b', statement, re.IGNORECASE):
+                        plan = conn.execute("EXPLAIN QUERY PLAN " + statement).fetchall()
+                        res += "QUERY PLAN\n" + "\n".join(f"  {row[-1]}" for row in plan) + "\n"
+                    res += render_cursor(
+                        conn.execute(statement),
+                        max_rows=self.max_rows.value or 50,
+                        max_chars=self.max_chars.value or 4000
+                    )
+                    res += "\n"
+                    executed += 1
+            if conn.in_transaction:
                 conn.commit()
         except Exception as e:
-            res += str(e)
-        
+            res += str(e) + "\n"
+            if conn.in_transaction:
+                conn.rollback()
+            if batched:
+                res += "Rolled back, no statement of this block was saved."
+            elif executed:
+                res += f"The {executed} statement{'' if executed == 1 else 's'} before it ran outside the block's " \
+                       "transaction and were kept, the open transaction was rolled back."
+
         return res
 
     
 TOOL_SPEC_BROWSER = """
-Shows the user which step to perform in a browser and outputs the resulting HTML. Use by writing the commands within markdown code blocks. Do not assume that elements are on the page, use the tool to discover the correct selectors. Perform only the action related to the task. You cannot define variables with the browser tool. only write_file(filename, selector)
+Shows the user which step to perform in a browser and outputs the visible text of the resulting page, with a selector for each link, button, field and heading. Use by writing the commands within markdown code blocks. Do not assume that elements are on the page, use the tool to discover the correct selectors. Perform only the action related to the task. You cannot define variables with the browser tool. Write one command per line; the commands are:
+goto(url), go_back(), go_forward(), reload(), click(selector), fill(selector, value), type(selector, text), press(selector, key), check(selector), uncheck(selector), select_option(selector, value), hover(selector), wait_for_selector(selector), screenshot(path), write_file(filename, selector)
 
 Example: TOOL: browser
 ```
@@ -513,23 +2021,509 @@ fill('[title="search"]', 'my search query')
 click('input[value="Google Search"]')
 ```
 browser OUTPUT:
-<html ....>
+1. goto("http://google.com") 812 ms
+2. fill('[title="search"]', 'my search query') 35 ms
+3. click('input[value="Google Search"]') 64 ms
+wait for network idle 540 ms
+URL: https://www.google.com/search?q=my+search+query
+TITLE: my search query - Google Search
+heading "Search Results" selector=h1
+link "My search result" selector=a[href="https://example.com/"]
+...
+
+After the first step only the lines that changed are shown, prefixed with + or -. Long pages are cut off
+with a "... N more lines omitted" line; use write_file to save the full text of an element.
+"""
+
+SNAPSHOT_SCRIPT = r"""
+(maxNodes) => {
+  const SKIP = new Set(['SCRIPT', 'STYLE', 'NOSCRIPT', 'TEMPLATE', 'SVG', 'CANVAS', 'IFRAME', 'HEAD']);
+  const LANDMARKS = {MAIN: 'main', NAV: 'navigation', ARTICLE: 'article', FORM: 'form', HEADER: 'banner', FOOTER: 'contentinfo'};
+  const quote = v => v.replace(/\\/g, '\\\\').replace(/"/g, '\\"');
+  const clean = v => (v || '').replace(/\s+/g, ' ').trim();
+  // Names and labels are clipped so a link wrapping a whole card stays one short line;
+  // body text is kept whole and bounded by the tool's max_chars instead.
+  const label = v => clean(v).slice(0, 100);
+  const unique = s => { try { return document.querySelectorAll(s).length === 1; } catch (e) { return false; } };
+  const selector = el => {
+    const tag = el.tagName.toLowerCase();
+    if (el.id && unique('#' + CSS.escape(el.id))) return '#' + CSS.escape(el.id);
+    for (const attr of ['data-testid', 'name', 'aria-label', 'title', 'placeholder', 'alt', 'href']) {
+      const value = el.getAttribute(attr);
+      if (value && value.length <= 100) {
+        const s = `${tag}[${attr}="${quote(value)}"]`;
+        if (unique(s)) return s;
+      }
+    }
+    if (unique(tag)) return tag;
+    const parts = [];
+    for (let node = el; node && node !== document.documentElement; node = node.parentElement) {
+      if (node !== el && node.id && unique('#' + CSS.escape(node.id))) { parts.unshift('#' + CSS.escape(node.id)); break; }
+      let part = node.tagName.toLowerCase();
+      const siblings = node.parentElement ? [...node.parentElement.children].filter(c => c.tagName === node.tagName) : [];
+      if (siblings.length > 1) part += `:nth-of-type(${siblings.indexOf(node) + 1})`;
+      parts.unshift(part);
+    }
+    return parts.join(' > ');
+  };
+  const roleOf = el => {
+    const role = el.getAttribute('role');
+    if (role) return role;
+    const tag = el.tagName;
+    if (tag === 'A' && el.hasAttribute('href')) return 'link';
+    if (tag === 'BUTTON' || tag === 'SUMMARY') return 'button';
+    if (tag === 'INPUT') {
+      const type = (el.getAttribute('type') || 'text').toLowerCase();
+      if (type === 'hidden') return null;
+      if (['button', 'submit', 'reset', 'image'].includes(type)) return 'button';
+      if (type === 'checkbox' || type === 'radio') return type;
+      return 'textbox';
+    }
+    if (tag === 'TEXTAREA') return 'textbox';
+    if (tag === 'SELECT') return 'combobox';
+    if (/^H[1-6]$/.test(tag)) return 'heading';
+    if (tag === 'IMG' && el.getAttribute('alt')) return 'img';
+    return LANDMARKS[tag] || null;
+  };
+  const nameOf = el => {
+    const ariaLabel = el.getAttribute('aria-label');
+    if (ariaLabel) return label(ariaLabel);
+    if (el.labels && el.labels.length) return label(el.labels[0].innerText);
+    if (el.tagName === 'IMG') return label(el.getAttribute('alt'));
+    if (['INPUT', 'TEXTAREA', 'SELECT'].includes(el.tagName)) {
+      return label(el.getAttribute('placeholder') || el.getAttribute('title') || (el.type === 'submit' ? el.value : ''));
+    }
+    return label(el.innerText);
+  };
+  const hidden = el => {
+    const style = getComputedStyle(el);
+    if (style.display === 'contents') return false;
+    return style.display === 'none' || style.visibility === 'hidden' || el.getClientRects().length === 0;
+  };
+  const nodes = [];
+  const walk = el => {
+    for (const child of el.childNodes) {
+      if (nodes.length >= maxNodes) return;
+      if (child.nodeType === Node.TEXT_NODE) {
+        const text = clean(child.textContent);
+        if (text) nodes.push({role: 'text', name: text});
+        continue;
+      }
+      if (child.nodeType !== Node.ELEMENT_NODE || SKIP.has(child.tagName.toUpperCase()) || hidden(child)) continue;
+      const role = roleOf(child);
+      if (!role) { walk(child); continue; }
+      const node = {role: role, name: nameOf(child), selector: selector(child)};
+      if (['textbox', 'combobox'].includes(role) && child.value) node.value = label(child.value);
+      if (['checkbox', 'radio'].includes(role)) node.value = child.checked ? 'checked' : 'unchecked';
+      if (LANDMARKS[child.tagName] || role === 'form') { node.name = ''; nodes.push(node); walk(child); continue; }
+      nodes.push(node);
+      if (!['link', 'button', 'heading', 'img', 'textbox', 'combobox', 'checkbox', 'radio'].includes(role)) walk(child);
+    }
+  };
+  if (document.body) walk(document.body);
+  return {title: document.title, nodes: nodes, truncated: nodes.length >= maxNodes};
+}
 """
 
+
+class PageSnapshot(NamedTuple):
+    """The visible content of a page, one line per text run or element of interest.
+
+    Interactive elements, headings and landmarks carry a selector that stays the same
+    between snapshots as long as the element does (id, name, aria-label, ... or a short
+    CSS path), so lines can be diffed and the selectors used in the next step.
+    """
+    url: str
+    title: str
+    lines: list
+
+    def header(self) -> str:
+        return f"URL: {self.url}\nTITLE: {self.title}"
+
+    def render(self) -> str:
+        return "\n".join([self.header()] + self.lines)
+
+
+def snapshot_line(node: dict) -> str:
+    if node['role'] == 'text':
+        return node['name']
+    line = node['role']
+    if node.get('name'):
+        line += ' "' + node['name'].replace('"', '\\"') + '"'
+    if node.get('value'):
+        line += ' = "' + node['value'].replace('"', '\\"') + '"'
+    return line + " selector=" + node['selector']
+
+
+def page_snapshot(page, max_nodes: int = 2000) -> PageSnapshot:
+    """Extracts a PageSnapshot, skipping scripts, styles and hidden elements."""
+    result = page.evaluate(SNAPSHOT_SCRIPT, max_nodes)
+    lines = []
+    previous_role = None
+    for node in result['nodes']:
+        # Adjacent text runs (e.g. split by inline markup) read better as one line.
+        if node['role'] == 'text' and previous_role == 'text':
+            lines[-1] += " " + node['name']
+        else:
+            lines.append(snapshot_line(node))
+        previous_role = node['role']
+    if result.get('truncated'):
+        lines.append(f"... page truncated after {max_nodes} elements")
+    return PageSnapshot(page.url, result['title'], lines)
+
+
+def snapshot_changes(previous: PageSnapshot, current: PageSnapshot) -> str:
+    """Renders current as lines added (+) and removed (-) since previous.
+
+    Falls back to the full snapshot when there is no previous one for the same URL or the
+    diff wouldn't be shorter.
+    """
+    full = current.render()
+    if previous is None or previous.url != current.url:
+        return full
+    changes = [
+        line[0] + " " + line[1:]
+        for line in difflib.unified_diff(previous.lines, current.lines, lineterm="", n=0)
+        if line[:1] in "+-" and not line.startswith(("+++", "---"))
+    ]
+    if not changes and previous.title == current.title:
+        return current.header() + "\n(no changes since the last step)"
+    diff = "\n".join([current.header() + "\n(changes since the last step)"] + changes)
+    return diff if len(diff) < len(full) else full
+
+
+def truncate_lines(text: str, max_chars: int) -> str:
+    """Cuts text at a line boundary so it fits max_chars, noting how many lines were left out."""
+    if len(text) <= max_chars:
+        return text
+    lines = text.splitlines()
+    kept = []
+    size = 0
+    for line in lines:
+        if size + len(line) + 1 > max_chars:
+            break
+        kept.append(line)
+        size += len(line) + 1
+    omitted = len(lines) - len(kept)
+    return "\n".join(kept + [f"... {omitted} more line{'' if omitted == 1 else 's'} omitted"])
+
+
+BROWSER_POOL_SIZE = int(os.getenv("BROWSER_POOL_SIZE", "2"))
+BROWSER_TIMEOUT = float(os.getenv("BROWSER_TIMEOUT", "3000"))
+BROWSER_NAVIGATION_TIMEOUT = float(os.getenv("BROWSER_NAVIGATION_TIMEOUT", "30000"))
+
+
+class BrowserWorker:
+    """One Playwright connection to the browser, owned by a single thread.
+
+    Playwright's sync API is bound to the thread that started it, so everything touching
+    this worker's browser or pages is submitted to its thread. Pages released by finished
+    sessions are kept (reset to about:blank) and handed to the next session.
+    """
+
+    def __init__(self, cdp_address: str, name: str):
+        self.cdp_address = cdp_address
+        self.thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self.playwright = None
+        self.browser = None
+        self.idle_pages = []
+
+    def connected(self) -> bool:
+        return self.browser is not None and self.browser.is_connected()
+
+    def connect(self):
+        if self.connected():
+            return self.browser
+        from playwright.sync_api import sync_playwright
+
+        if self.playwright is None:
+            self.playwright = sync_playwright().start()
+        self.browser = self.playwright.chromium.connect_over_cdp(self.cdp_address)
+        self.idle_pages = []
+        return self.browser
+
+    def new_page(self):
+        browser = self.connect()
+        while self.idle_pages:
+            page = self.idle_pages.pop()
+            if not page.is_closed():
+                return page
+        context = browser.contexts[0] if len(browser.contexts) > 0 else browser.new_context()
+        return context.new_page()
+
+    def recycle(self, page, max_idle_pages: int) -> None:
+        if page is None or page.is_closed() or not self.connected():
+            return
+        try:
+            if len(self.idle_pages) < max_idle_pages:
+                page.goto("about:blank")
+                self.idle_pages.append(page)
+            else:
+                page.close()
+        except Exception as e:
+            print(f"Dropping browser page: {e}")
+
+    def shutdown(self) -> None:
+        for page in self.idle_pages:
+            if not page.is_closed():
+                page.close()
+        self.idle_pages = []
+        if self.connected():
+            self.browser.close()
+        if self.playwright is not None:
+            self.playwright.stop()
+        self.browser = None
+        self.playwright = None
+
+    def close(self) -> None:
+        self.thread.submit(self.shutdown).result()
+        self.thread.shutdown()
+
+
+class BrowserSession:
+    """A page of a BrowserPool that keeps its state between tool runs.
+
+    Tools using the same session name act on the same page, e.g. NlpTool reads the page
+    BrowserTool navigated. Before each call the page is health checked: if the browser
+    connection dropped, or the page was closed or crashed, a fresh one replaces it.
+    """
+
+    def __init__(self, pool, worker: BrowserWorker, name: str, timeout: float, navigation_timeout: float):
+        self.pool = pool
+        self.worker = worker
+        self.name = name
+        # Tools holding the session; the last one to release it ends it.
+        self.users = 0
+        self.timeout = timeout
+        self.navigation_timeout = navigation_timeout
+        self.page = None
+        self.crashed = False
+        self.snapshot = None
+
+    def healthy_page(self):
+        if self.page is None or self.crashed or self.page.is_closed() or not self.worker.connected():
+            if self.page is not None:
+                print(f"Browser session {self.name} lost its page, opening a new one")
+            self.page = self.worker.new_page()
+            self.crashed = False
+            self.snapshot = None
+            self.page.on("crash", lambda page: setattr(self, 'crashed', True))
+        self.page.set_default_timeout(self.timeout)
+        self.page.set_default_navigation_timeout(self.navigation_timeout)
+        return self.page
+
+    def submit(self, fn, *args) -> Future:
+        """Runs fn(page, *args) on the worker thread."""
+        return self.worker.thread.submit(lambda: fn(self.healthy_page(), *args))
+
+    def run(self, fn, *args):
+        return self.submit(fn, *args).result()
+
+
+class BrowserPool:
+    """Shared Playwright connections to one browser over CDP.
+
+    Sessions are spread over `size` workers, each with its own connection and thread, so
+    agents using different sessions browse in parallel while the connection setup is
+    paid once per worker. timeout and navigation_timeout (milliseconds) are the defaults
+    for new sessions.
+    """
+
+    def __init__(self, cdp_address: str, size: int = None, timeout: float = None, navigation_timeout: float = None,
+                 max_idle_pages: int = 2):
+        self.cdp_address = cdp_address
+        self.workers = [BrowserWorker(cdp_address, f"browser-{i}") for i in range(size or BROWSER_POOL_SIZE)]
+        self.timeout = timeout or BROWSER_TIMEOUT
+        self.navigation_timeout = navigation_timeout or BROWSER_NAVIGATION_TIMEOUT
+        self.max_idle_pages = max_idle_pages
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def session(self, name: str = "default", timeout: float = None, navigation_timeout: float = None) -> BrowserSession:
+        with self.lock:
+            session = self.sessions.get(name)
+            if session is None:
+                load = {id(worker): 0 for worker in self.workers}
+                for existing in self.sessions.values():
+                    load[id(existing.worker)] += 1
+                worker = min(self.workers, key=lambda w: load[id(w)])
+                session = self.sessions[name] = BrowserSession(
+                    self, worker, name, self.timeout, self.navigation_timeout
+                )
+            session.users += 1
+            if timeout:
+                session.timeout = timeout
+            if navigation_timeout:
+                session.navigation_timeout = navigation_timeout
+            return session
+
+    def release(self, session: BrowserSession) -> None:
+        """Hands back a session from session(). Once no tool holds it, it ends and its page is
+        kept for reuse by the next session."""
+        with self.lock:
+            session.users -= 1
+            if session.users > 0 or self.sessions.get(session.name) is not session:
+                return
+            del self.sessions[session.name]
+        page, session.page = session.page, None
+        session.worker.thread.submit(session.worker.recycle, page, self.max_idle_pages)
+
+    def close(self) -> None:
+        with self.lock:
+            self.sessions = {}
+        for worker in self.workers:
+            worker.close()
+
+
+browser_pools = {}
+browser_pools_lock = threading.Lock()
+
+
+def get_browser_pool(cdp_address: str, size: int = None) -> BrowserPool:
+    """The pool for a CDP address. size only applies when the pool is first created."""
+    with browser_pools_lock:
+        pool = browser_pools.get(cdp_address)
+        if pool is None:
+            pool = browser_pools[cdp_address] = BrowserPool(cdp_address, size)
+        return pool
+
+
+# verb: (parameters, number of required parameters, kind). "navigate" commands may load a
+# new page, so the page is left to settle before anything reads it; "read" commands need
+# a settled page.
+BROWSER_COMMANDS = {
+    'goto': (('url',), 1, 'navigate'),
+    'go_back': ((), 0, 'navigate'),
+    'go_forward': ((), 0, 'navigate'),
+    'reload': ((), 0, 'navigate'),
+    'click': (('selector',), 1, 'navigate'),
+    'press': (('selector', 'key'), 2, 'navigate'),
+    'fill': (('selector', 'value'), 2, 'act'),
+    'type': (('selector', 'text'), 2, 'act'),
+    'check': (('selector',), 1, 'act'),
+    'uncheck': (('selector',), 1, 'act'),
+    'select_option': (('selector', 'value'), 2, 'act'),
+    'hover': (('selector',), 1, 'act'),
+    'wait_for_selector': (('selector', 'state'), 1, 'act'),
+    'screenshot': (('path', 'full_page'), 1, 'read'),
+    'write_file': (('file', 'selector'), 2, 'read'),
+}
+BROWSER_COMMAND_ALIASES = {
+    'save_screenshot': 'screenshot',
+    'save_text': 'write_file',
+    'save_to_file': 'write_file',
+}
+
+
+class BrowserCommand(NamedTuple):
+    line: str
+    verb: str
+    params: dict
+
+    @property
+    def kind(self) -> str:
+        return BROWSER_COMMANDS[self.verb][2]
+
+
+def parse_browser_command(line: str) -> BrowserCommand:
+    """Parses one line like `fill('#q', "text")`. Arguments must be literals."""
+    try:
+        call = ast.parse(line, mode='eval').body
+    except SyntaxError as e:
+        raise Exception(e.msg)
+    if not isinstance(call, ast.Call):
+        raise Exception("expected a command like click(selector)")
+    func = call.func
+    # Accept page.goto(...) as written by models used to Playwright.
+    if isinstance(func, ast.Attribute) and isinstance(func.value, ast.Name) and func.value.id == 'page':
+        name = func.attr
+    elif isinstance(func, ast.Name):
+        name = func.id
+    else:
+        raise Exception("expected a command like click(selector)")
+    verb = BROWSER_COMMAND_ALIASES.get(name, name)
+    if verb not in BROWSER_COMMANDS:
+        raise Exception(f"unknown command {name}, use one of {', '.join(BROWSER_COMMANDS)}")
+
+    parameters, required, _ = BROWSER_COMMANDS[verb]
+    if len(call.args) > len(parameters):
+        raise Exception(f"{name} takes at most {len(parameters)} arguments")
+    params = {}
+    try:
+        for parameter, arg in zip(parameters, call.args):
+            params[parameter] = ast.literal_eval(arg)
+        for keyword in call.keywords:
+            if keyword.arg not in parameters:
+                raise Exception(f"{name} has no argument {keyword.arg}")
+            params[keyword.arg] = ast.literal_eval(keyword.value)
+    except ValueError:
+        raise Exception("arguments must be plain strings, numbers or booleans")
+    missing = [parameter for parameter in parameters[:required] if parameter not in params]
+    if missing:
+        raise Exception(f"{name} is missing {', '.join(missing)}")
+    return BrowserCommand(line, verb, params)
+
+
+def parse_browser_script(code: list) -> list:
+    """Parses every command of a script, raising one error listing all invalid lines."""
+    commands = []
+    errors = []
+    for number, line in enumerate(code, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            commands.append(parse_browser_command(line))
+        except Exception as e:
+            errors.append(f"line {number}: {line}: {e}")
+    if errors:
+        raise Exception("Invalid browser script, nothing was run:\n" + "\n".join(errors))
+    return commands
+
+
+def run_browser_command(page, command: BrowserCommand) -> None:
+    params = command.params
+    if command.verb == 'write_file':
+        with open(params['file'], "w") as f:
+            f.write(page.inner_text(params['selector']))
+    elif command.verb == 'goto':
+        # Later reads wait for the network to settle, the navigation itself doesn't have to.
+        page.goto(params['url'], wait_until="domcontentloaded")
+    else:
+        getattr(page, command.verb)(**params)
+
+
 @xai_component
 class BrowserTool(Component):
     """A component that implements a browser tool.
     Uses the Playwright library to interact with the browser.
     Capable of saving screenshots and writing to files directly from the browser context.
+    Pages come from a BrowserPool shared by every tool connected to the same address.
 
     #### inPorts:
     - cdp_address: The address to the Chrome DevTools Protocol (CDP), allowing interaction with a Chrome instance.
+    - session: Name of the browser session (page) to use. Tools with the same session share a page. Defaults to "default".
+    - timeout: Timeout in milliseconds for each page action. Defaults to BROWSER_TIMEOUT (3000).
+    - navigation_timeout: Timeout in milliseconds for navigations. Defaults to BROWSER_NAVIGATION_TIMEOUT (30000).
+    - pool_size: Number of parallel browser connections when the pool is created. Defaults to BROWSER_POOL_SIZE (2).
+    - snapshot: How the page is shown to the agent: "text" for the visible text and elements with their selectors, "html" for the raw HTML. Defaults to "text".
+    - diff: Whether to show only the lines that changed since the previous step on the same URL. Defaults to True.
+    - max_chars: Maximum number of characters of page output. Defaults to 4000.
+    - idle_timeout: How long in milliseconds to wait for the network to go idle after a navigation, before the page is read. Defaults to 5000.
 
     #### outPorts:
     - tool_spec: The specification of the browser tool.
     """
 
     cdp_address: InArg[str]
+    session: InArg[str]
+    timeout: InArg[float]
+    navigation_timeout: InArg[float]
+    pool_size: InArg[int]
+    snapshot: InArg[str]
+    diff: InArg[bool]
+    max_chars: InArg[int]
+    idle_timeout: InArg[float]
     tool_spec: OutArg[dict]
 
     def execute(self, ctx) -> None:
@@ -541,9 +2535,15 @@ class BrowserTool(Component):
             'instance': self
         }
 
-        self.chrome = None
-        self.playwright = None
-        self.page = None
+        previous = getattr(self, 'browser_session', None)
+        self.browser_session = get_browser_pool(self.cdp_address.value, self.pool_size.value).session(
+            self.session.value or "default",
+            timeout=self.timeout.value,
+            navigation_timeout=self.navigation_timeout.value
+        )
+        if previous is not None:
+            # Ends the previous run's session if it was switched away from and nothing else uses it.
+            previous.pool.release(previous)
         self.tool_spec.value = spec
 
     def run_tool(self, tool_code) -> str:
@@ -572,35 +2572,8 @@ class BrowserTool(Component):
         
         res = ""
         try:
-            import playwright
-            from playwright.sync_api import sync_playwright
-            
-            if not self.chrome:
-                self.playwright = sync_playwright().__enter__()
-                self.chrome = self.playwright.chromium.connect_over_cdp(self.cdp_address.value)
-
-            if not self.page:
-                if len(self.chrome.contexts) > 0:
-                    self.page = self.chrome.contexts[0].new_page()
-                    self.page.set_default_timeout(3000)
-                else:
-                    self.page = self.chrome.new_context().new_page()
-                    self.page.set_default_timeout(3000)
-
-            self.page.save_screenshot = self.page.screenshot
-            def write_file(file, selector):
-                with open(file, "w") as f:
-                    f.write(self.page.inner_text(selector))
-            
-            self.page.write_file = write_file
-            self.page.save_text = write_file
-            self.page.save_to_file = write_file
-            for action in code:
-                if not action.startswith("#"):
-                    eval("self.page." + action)
-                    
-            res += self.page.content()[:4000]
-            #browser.close()
+            commands = parse_browser_script(code)
+            res += self.browser_session.run(self.run_commands, commands)
         except Exception as e:
             res += str(e)
         
@@ -609,6 +2582,52 @@ class BrowserTool(Component):
         
         return res
 
+    def run_commands(self, page, commands: list) -> str:
+        """Runs the commands in one go on the browser thread, timing each of them.
+
+        Stops at the first failing command; the page is still shown so the agent can see
+        where it ended up.
+        """
+        report = []
+        unsettled = False
+        for number, command in enumerate(commands, 1):
+            if command.kind == 'read' and unsettled:
+                report.append(self.wait_for_idle(page))
+                unsettled = False
+            start = time.perf_counter()
+            try:
+                run_browser_command(page, command)
+            except Exception as e:
+                report.append(f"{number}. {command.line} failed after {(time.perf_counter() - start) * 1000:.0f} ms: {e}")
+                break
+            report.append(f"{number}. {command.line} {(time.perf_counter() - start) * 1000:.0f} ms")
+            unsettled = unsettled or command.kind == 'navigate'
+        if unsettled:
+            report.append(self.wait_for_idle(page))
+
+        return "\n".join(report + [self.page_output(page)])
+
+    def wait_for_idle(self, page) -> str:
+        start = time.perf_counter()
+        try:
+            page.wait_for_load_state("networkidle", timeout=self.idle_timeout.value or 5000)
+            status = ""
+        except Exception:
+            # Pages that keep polling never go idle, they can still be read.
+            status = " (timed out)"
+        return f"wait for network idle {(time.perf_counter() - start) * 1000:.0f} ms{status}"
+
+    def page_output(self, page) -> str:
+        max_chars = self.max_chars.value or 4000
+        if self.snapshot.value == "html":
+            return page.content()[:max_chars]
+
+        session = self.browser_session
+        snapshot = page_snapshot(page)
+        output = snapshot_changes(session.snapshot if self.diff.value is not False else None, snapshot)
+        session.snapshot = snapshot
+        return truncate_lines(output, max_chars)
+
 TOOL_SPEC_NLP = """
 NLP tool provides methods to summarize, extract, classify, ner or translate informtaion on the current page.
 To use use one of the words above followed by any arguments and finally a CSS selector.
@@ -625,11 +2644,17 @@ class NlpTool(Component):
 
     #### inPorts:
     - cdp_address: The address to the Chrome DevTools Protocol (CDP).
+    - retry_policy: Optional retry policy for the LLM call.
+    - session: Name of the browser session whose page is read, e.g. the BrowserTool's. Defaults to "default".
+    - timeout: Timeout in milliseconds for reading a selector. Defaults to BROWSER_TIMEOUT (3000).
 
     #### outPorts:
     - tool_spec: The specification of the NLP tool.
     """
     cdp_address: InArg[str]
+    retry_policy: InArg[RetryPolicy]
+    session: InArg[str]
+    timeout: InArg[float]
     tool_spec: OutArg[dict]
 
     def execute(self, ctx) -> None:
@@ -641,13 +2666,58 @@ class NlpTool(Component):
             'instance': self
         }
 
-        self.chrome = None
-        self.playwright = None
-        self.page = None
+        previous = getattr(self, 'browser_session', None)
+        self.browser_session = get_browser_pool(self.cdp_address.value).session(
+            self.session.value or "default",
+            timeout=self.timeout.value
+        )
+        if previous is not None:
+            previous.pool.release(previous)
         self.tool_spec.value = spec
 
     def run_tool(self, tool_code) -> str:
         print(f"Running tool browser")
+        res = ""
+        try:
+            for action, content in self.browser_session.run(self.read_selectors, self.selector_actions(tool_code)):
+                res += action + "OUTPUT:\n"
+                res += llm_call("gpt-3.5-turbo", self.nlp_prompt(action, content), 0.0, 100, retry_policy=self.retry_policy.value)
+                res += "\n"
+        except Exception as e:
+            res += str(e)
+
+        print("*** PAGE CONTENT ***")
+        print(res)
+
+        return res
+
+    async def run_tool_async(self, tool_code) -> str:
+        print("Running tool browser")
+        res = ""
+        try:
+            selections = await asyncio.wrap_future(
+                self.browser_session.submit(self.read_selectors, self.selector_actions(tool_code))
+            )
+            responses = await asyncio.gather(*[
+                async_llm_call("gpt-3.5-turbo", self.nlp_prompt(action, content), 0.0, 100, retry_policy=self.retry_policy.value)
+                for action, content in selections
+            ])
+            for (action, _), response in zip(selections, responses):
+                res += action + "OUTPUT:\n"
+                res += response
+                res += "\n"
+        except Exception as e:
+            res += str(e)
+
+        print("*** PAGE CONTENT ***")
+        print(res)
+
+        return res
+
+    def nlp_prompt(self, action: str, content: str) -> str:
+        return action + "\n" + action.split(" ")[-1] + " is: \n---\n" + content
+
+    def selector_actions(self, tool_code) -> list:
         lines = tool_code.splitlines()
         code = []
         include = False
@@ -669,40 +2739,11 @@ class NlpTool(Component):
         if not any:
             for line in lines[1:]:
                 code.append(line + "\n")
-        
-        res = ""
-        try:
-            import playwright
-            from playwright.sync_api import sync_playwright
-            
-            if not self.chrome:
-                self.playwright = sync_playwright().__enter__()
-                self.chrome = self.playwright.chromium.connect_over_cdp(self.cdp_address.value)
-
-            if not self.page:
-                if len(self.chrome.contexts) > 0:
-                    self.page = self.chrome.contexts[0].pages[0]
-                    self.page.set_default_timeout(3000)
-                else:
-                    self.page = self.chrome.new_context().new_page()
-                    self.page.set_default_timeout(3000)
+        return [action for action in code if not action.startswith("#")]
 
-            
-            for action in code:
-                if not action.startswith("#"):
-                    content = self.page.inner_text(action.split(" ")[-1])
-                    prompt = action + "\n" + action.split(" ")[-1] + " is: \n---\n"
-                    res += action + "OUTPUT:\n"
-                    res += llm_call("gpt-3.5-turbo", prompt, 0.0, 100)
-                    res += "\n"
-
-        except Exception as e:
-            res += str(e)
-        
-        print("*** PAGE CONTENT ***")
-        print(res)
-        
-        return res
+    def read_selectors(self, page, actions: list) -> list:
+        """Returns (action, inner text of the action's selector) for every action."""
+        return [(action, page.inner_text(action.split(" ")[-1])) for action in actions]
 
 TOOL_SPEC_PYTHON = """
 Execute python code in a virtual environment.  
@@ -847,12 +2888,14 @@ class ScratchPadTool(Component):
 
     #### inPorts:
     - file_name: The name of the file that will be used as the scratch pad.
+    - retry_policy: Optional retry policy for the LLM call.
 
     #### outPorts:
     - tool_spec: The specification of the ScratchPad tool.
     """
 
     file_name: InArg[str]
+    retry_policy: InArg[RetryPolicy]
     tool_spec: OutArg[dict]
             
     def execute(self, ctx) -> None:
@@ -868,56 +2911,316 @@ class ScratchPadTool(Component):
         self.tool_spec.value = spec
         
     def run_tool(self, tool_code) -> str:
-        current_scratch = ""
-        with open(self.file_name.value, "r") as f:
-            current_scratch = f.read().strip()
+        current_scratch = self.read_scratch()
         
         summary = None
         if len(current_scratch) > 0:
-            summary = llm_call(
-                "gpt-3.5-turbo",
-                f"Summarize the following text with bullet points using a second person perspective. " +
-                "Keep only the salient points.\n---\n {current_scratch}",
-                0.0,
-                1000
-            )
+            summary = llm_call("gpt-3.5-turbo", self.summary_prompt(current_scratch), 0.0, 1000, retry_policy=self.retry_policy.value)
         
+        self.write_scratch(summary, tool_code)
+        return ""
+
+    async def run_tool_async(self, tool_code) -> str:
+        current_scratch = self.read_scratch()
+
+        summary = None
+        if len(current_scratch) > 0:
+            summary = await async_llm_call("gpt-3.5-turbo", self.summary_prompt(current_scratch), 0.0, 1000, retry_policy=self.retry_policy.value)
+
+        self.write_scratch(summary, tool_code)
+        return ""
+
+    def summary_prompt(self, current_scratch: str) -> str:
+        return "Summarize the following text with bullet points using a second person perspective. " + \
+            f"Keep only the salient points.\n---\n {current_scratch}"
+
+    def read_scratch(self) -> str:
+        with open(self.file_name.value, "r") as f:
+            return f.read().strip()
+
+    def write_scratch(self, summary, tool_code) -> None:
         with open(self.file_name.value, "w") as f:
             if summary:
                 f.write(summary)
                 f.write("\n")
             f.write(tool_code[len('scratch-pad'):])
-            
-        return ""
 
 
 class VectoMemoryImpl(Memory):
+    # Vecto has no server-side metadata filter, so filtered queries over-fetch and filter locally.
+    filter_overfetch = 4
+
     def __init__(self, vs):
         self.vs = vs
 
-    def query(self, query: str, n: int) -> list:
-        return self.vs.lookup(query, 'TEXT', n).results
-    def add(self, id: str, text: str, metadata: dict) -> None:
+    def query(self, query: str, n: int, filter: dict = None, namespace: str = None) -> list:
+        if not filter and namespace is None:
+            return self.vs.lookup(query, 'TEXT', n).results
+        if namespace is not None:
+            filter = {'$and': [filter or {}, {'namespace': namespace}]}
+        results = self.vs.lookup(query, 'TEXT', n * self.filter_overfetch).results
+        return [result for result in results if metadata_matches(result.attributes, filter)][:n]
+
+    def add(self, id: str, text: str, metadata: dict, namespace: str = None) -> None:
         from vecto import vecto_toolbelt
 
+        if namespace is not None:
+            metadata = dict(metadata, namespace=namespace)
         vecto_toolbelt.ingest_text(self.vs, [text], [metadata])
+        self.version += 1
+
+    def add_many(self, ids: list, texts: list, metadatas: list, namespace: str = None) -> None:
+        from vecto import vecto_toolbelt
+
+        if namespace is not None:
+            metadatas = [dict(metadata, namespace=namespace) for metadata in metadatas]
+        vecto_toolbelt.ingest_text(self.vs, list(texts), list(metadatas))
+        self.version += 1
+
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+
+def normalize_embedding_text(text: str) -> str:
+    return " ".join(text.split())
+
+
+class EmbeddingCache:
+    """Cache of float32 embedding vectors keyed by model and whitespace-normalized text.
+
+    An in-memory LRU is backed by an optional SQLite file, so vectors for text seen in
+    earlier runs are not embedded again. Cached vectors are read-only.
+    """
+
+    def __init__(self, path: str = None, max_memory_entries: int = 4096, max_disk_entries: int = 1000000):
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.puts_since_trim = 0
+        self.conn = None
+        if path:
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.execute("CREATE TABLE IF NOT EXISTS embedding_cache (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+            self.conn.commit()
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        return hashlib.sha256((model + "\0" + text).encode("utf-8")).hexdigest()
+
+    def get(self, model: str, text: str):
+        key = self.make_key(model, text)
+        with self.lock:
+            vector = self.entries.get(key)
+            if vector is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return vector
+
+            if self.conn is not None:
+                row = self.conn.execute("SELECT vector FROM embedding_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    vector = np.frombuffer(row[0], dtype=np.float32)
+                    self.remember(key, vector)
+                    self.hits += 1
+                    return vector
+
+            self.misses += 1
+            return None
+
+    def put(self, model: str, text: str, vector) -> np.ndarray:
+        key = self.make_key(model, text)
+        vector = np.array(vector, dtype=np.float32)
+        vector.flags.writeable = False
+        with self.lock:
+            self.remember(key, vector)
+            if self.conn is not None:
+                self.conn.execute("INSERT OR REPLACE INTO embedding_cache (key, vector) VALUES (?, ?)", (key, vector.tobytes()))
+                self.conn.commit()
+                self.puts_since_trim += 1
+                if self.puts_since_trim >= 1000:
+                    self.trim_disk()
+        return vector
+
+    def remember(self, key: str, vector: np.ndarray) -> None:
+        self.entries[key] = vector
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_memory_entries:
+            self.entries.popitem(last=False)
+
+    def trim_disk(self) -> None:
+        self.puts_since_trim = 0
+        count = self.conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+        if count > self.max_disk_entries:
+            self.conn.execute(
+                "DELETE FROM embedding_cache WHERE rowid IN (SELECT rowid FROM embedding_cache ORDER BY rowid LIMIT ?)",
+                (count - self.max_disk_entries,)
+            )
+            self.conn.commit()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'memory_entries': len(self.entries)
+        }
+
+
+class EmbeddingBatcher:
+    """Coalesces embedding requests into batched `embeddings.create(input=[...])` calls.
+
+    Callers enqueue texts and block on a future. A background worker waits up to max_wait
+    seconds after the first queued text to gather more, then sends up to max_batch_size
+    texts in one request. Concurrent agents and bulk inserts share round trips this way.
+    Texts found in the embedding cache are answered without being queued.
+    """
+
+    def __init__(self, model: str = EMBEDDING_MODEL, max_batch_size: int = 256, max_wait: float = 0.005,
+                 retry_policy: RetryPolicy = None, cache: EmbeddingCache = None):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.retry_policy = retry_policy
+        self.cache = cache
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.worker = None
+
+    def embed(self, text: str) -> list:
+        return self.submit(text).result()
+
+    def embed_many(self, texts: list) -> list:
+        futures = [self.submit(text) for text in texts]
+        return [future.result() for future in futures]
+
+    async def embed_async(self, text: str) -> list:
+        return await asyncio.wrap_future(self.submit(text))
+
+    def submit(self, text: str) -> Future:
+        future = Future()
+        text = normalize_embedding_text(text)
+        if self.cache is not None:
+            vector = self.cache.get(self.model, text)
+            if vector is not None:
+                future.set_result(vector)
+                return future
+
+        self.queue.put((text, future))
+        if self.worker is None or not self.worker.is_alive():
+            with self.lock:
+                if self.worker is None or not self.worker.is_alive():
+                    self.worker = threading.Thread(target=self.run, name="embedding-batcher", daemon=True)
+                    self.worker.start()
+        return future
+
+    def create(self, texts: list) -> list:
+        client = get_llm_client(self.model)
+        response = call_with_retry(
+            lambda: client.embeddings.create(input=texts, model=self.model),
+            self.retry_policy,
+            get_rate_limiter(self.model)
+        )
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    def run(self) -> None:
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            # Identical texts queued together are embedded once.
+            texts = list(dict.fromkeys(text for text, _ in batch))
+            try:
+                vectors = self.create(texts)
+                if self.cache is not None:
+                    vectors = [self.cache.put(self.model, text, vector) for text, vector in zip(texts, vectors)]
+                else:
+                    vectors = [np.array(vector, dtype=np.float32) for vector in vectors]
+                by_text = dict(zip(texts, vectors))
+                for text, future in batch:
+                    future.set_result(by_text[text])
+            except Exception as e:
+                # Whatever failed (the request, the cache), the worker must stay alive and
+                # every caller of this batch must be answered.
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+
+embedding_cache = EmbeddingCache(os.getenv("EMBEDDING_CACHE_PATH"))
+ada_embedder = EmbeddingBatcher(cache=embedding_cache)
+
+
+def set_embedding_cache(cache: EmbeddingCache) -> None:
+    global embedding_cache
+    embedding_cache = cache
+    ada_embedder.cache = cache
 
 
 def get_ada_embedding(text):
-    s = text.replace("\n", " ")
-    return openai.embeddings.create(input=[s], model="text-embedding-ada-002").data[0].embedding
+    return ada_embedder.embed(text)
+
+
+def get_ada_embeddings(texts):
+    return ada_embedder.embed_many(texts)
 
 
 class PineconeMemoryImpl(Memory):
+    # Pinecone recommends at most 100 vectors per upsert request.
+    upsert_batch_size = 100
+
     def __init__(self, index, namespace):
         self.index = index
         self.namespace = namespace
 
-    def query(self, query: str, n: int) -> list:
-        return self.index.query(get_ada_embedding(query), top_k=n, include_metadata=True, namespace=self.namespace)
+    def query(self, query: str, n: int, filter: dict = None, namespace: str = None) -> list:
+        return self.index.query(
+            get_ada_embedding(query).tolist(),
+            top_k=n,
+            include_metadata=True,
+            filter=filter or None,
+            namespace=namespace if namespace is not None else self.namespace
+        )
+
+    def add(self, vector_id: str, text: str, metadata: dict, namespace: str = None) -> None:
+        self.index.upsert(
+            [(vector_id, get_ada_embedding(text).tolist(), metadata)],
+            namespace=namespace if namespace is not None else self.namespace
+        )
+        self.version += 1
+
+    def query_many(self, queries: list, n: int, filter: dict = None, namespace: str = None) -> list:
+        # Pinecone queries one vector per request, but the embeddings are fetched in one batch.
+        return [
+            self.index.query(
+                vector.tolist(),
+                top_k=n,
+                include_metadata=True,
+                filter=filter or None,
+                namespace=namespace if namespace is not None else self.namespace
+            )
+            for vector in get_ada_embeddings(queries)
+        ]
 
-    def add(self, vector_id: str, text: str, metadata: dict) -> None:
-        self.index.upsert([(vector_id, get_ada_embedding(text), metadata)], namespace=self.namespace)
+    def add_many(self, ids: list, texts: list, metadatas: list, namespace: str = None) -> None:
+        vectors = get_ada_embeddings(texts)
+        items = [(vector_id, vector.tolist(), metadata) for vector_id, vector, metadata in zip(ids, vectors, metadatas)]
+        for start in range(0, len(items), self.upsert_batch_size):
+            self.index.upsert(
+                items[start:start + self.upsert_batch_size],
+                namespace=namespace if namespace is not None else self.namespace
+            )
+        self.version += 1
 
 
 class NumpyQueryResult(NamedTuple):
@@ -926,51 +3229,1108 @@ class NumpyQueryResult(NamedTuple):
     attributes: dict
 
 
+def grow_rows(array, size: int, capacity: int, row_shape: tuple, dtype) -> np.ndarray:
+    """Returns a new array of `capacity` rows holding the first `size` rows of `array`."""
+    grown = np.empty((capacity,) + row_shape, dtype=dtype)
+    if array is not None:
+        grown[:size] = array[:size]
+    return grown
+
+
+def map_rows(path: str, capacity: int, row_shape: tuple, dtype) -> np.memmap:
+    """Memory-maps `capacity` rows of a raw file, extending the file if needed."""
+    capacity = max(capacity, 1)
+    row_bytes = int(np.prod(row_shape, dtype=np.int64)) * np.dtype(dtype).itemsize
+    with open(path, "ab") as f:
+        if f.tell() < capacity * row_bytes:
+            f.truncate(capacity * row_bytes)
+    return np.memmap(path, dtype=dtype, mode="r+", shape=(capacity,) + row_shape)
+
+
+NAMESPACE_FIELD = '$namespace'
+
+
+def metadata_key(value):
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return json.dumps(value, sort_keys=True, default=str)
+
+
+class MetadataIndex:
+    """Inverted index over row metadata that turns a Memory filter into a boolean row mask.
+
+    Equality, $in and $nin look rows up in per-value postings lists. Range operators compare
+    a float column per field, built on first use and extended as rows are added. Namespaces
+    are indexed as the reserved field '$namespace'.
+
+    Only scalar values are indexed, and strings only up to max_value_chars, so free text
+    such as task results costs no index memory. With `fields`, only those fields are
+    indexed. Filters on anything not indexed are evaluated against the rows' metadata.
+    """
+
+    def __init__(self, fields: list = None, max_value_chars: int = 256):
+        self.size = 0
+        self.postings = {}
+        self.values = {}
+        self.numeric = {}
+        self.fields = set(fields) if fields is not None else None
+        self.max_value_chars = max_value_chars
+        # field -> rows whose value for it was too large or not a scalar
+        self.unindexed = {}
+
+    def indexed_field(self, field: str) -> bool:
+        return field == NAMESPACE_FIELD or self.fields is None or field in self.fields
+
+    def indexable(self, value) -> bool:
+        if isinstance(value, str):
+            return len(value) <= self.max_value_chars
+        return value is None or isinstance(value, (bool, int, float))
+
+    def add(self, metadatas, namespaces) -> None:
+        for metadata, namespace in zip(metadatas, namespaces):
+            fields = dict(metadata or {})
+            fields[NAMESPACE_FIELD] = namespace
+            for field, value in fields.items():
+                if not self.indexed_field(field):
+                    continue
+                if field != NAMESPACE_FIELD and not self.indexable(value):
+                    self.unindexed.setdefault(field, array.array('Q')).append(self.size)
+                    continue
+                self.postings.setdefault(field, {}).setdefault(metadata_key(value), array.array('Q')).append(self.size)
+                column = self.values.setdefault(field, [])
+                column.extend([None] * (self.size - len(column)))
+                column.append(value)
+            self.size += 1
+
+    def rows_mask(self, field: str, values) -> np.ndarray:
+        mask = np.zeros(self.size, dtype=bool)
+        postings = self.postings.get(field, {})
+        for value in values:
+            rows = postings.get(metadata_key(value))
+            if rows:
+                mask[np.array(rows, dtype=np.int64)] = True
+        return mask
+
+    def present_mask(self, field: str) -> np.ndarray:
+        mask = np.zeros(self.size, dtype=bool)
+        for rows in self.postings.get(field, {}).values():
+            mask[np.array(rows, dtype=np.int64)] = True
+        return mask
+
+    def numeric_column(self, field: str) -> np.ndarray:
+        column, covered = self.numeric.get(field, (np.empty(0), 0))
+        if covered < self.size:
+            values = self.values.get(field, [])
+            extra = np.full(self.size - covered, np.nan)
+            for row in range(covered, min(len(values), self.size)):
+                value = values[row]
+                if value is not None and not isinstance(value, bool):
+                    try:
+                        extra[row - covered] = float(value)
+                    except (TypeError, ValueError):
+                        pass
+            column = np.concatenate([column, extra])
+            self.numeric[field] = (column, self.size)
+        return column
+
+    def scan_mask(self, field: str, condition, metadata, rows) -> np.ndarray:
+        return np.array([metadata_matches(metadata[row] or {}, {field: condition}) for row in rows], dtype=bool)
+
+    def field_mask(self, field: str, condition, metadata) -> np.ndarray:
+        if not self.indexed_field(field):
+            return self.scan_mask(field, condition, metadata, range(self.size))
+        mask = self.indexed_mask(field, condition)
+        unindexed = self.unindexed.get(field)
+        if unindexed:
+            rows = np.array(unindexed, dtype=np.int64)
+            mask[rows] = self.scan_mask(field, condition, metadata, rows)
+        return mask
+
+    def indexed_mask(self, field: str, condition) -> np.ndarray:
+        if not isinstance(condition, dict):
+            condition = {'$eq': condition}
+        mask = np.ones(self.size, dtype=bool)
+        for op, arg in condition.items():
+            if op == '$eq':
+                mask &= self.rows_mask(field, [arg])
+            elif op == '$in':
+                mask &= self.rows_mask(field, arg)
+            elif op == '$ne':
+                mask &= ~self.rows_mask(field, [arg])
+            elif op == '$nin':
+                mask &= ~self.rows_mask(field, arg)
+            elif op == '$exists':
+                present = self.present_mask(field)
+                mask &= present if arg else ~present
+            elif op in FILTER_RANGE_OPERATORS:
+                # NaN (missing or non-numeric) compares False.
+                with np.errstate(invalid='ignore'):
+                    mask &= FILTER_RANGE_OPERATORS[op](self.numeric_column(field), float(arg))
+            else:
+                raise Exception(f"Unknown filter operator {op}")
+        return mask
+
+    def mask(self, filter: dict, metadata) -> np.ndarray:
+        """metadata is the rows' metadata, read for the fields and values that are not indexed."""
+        mask = np.ones(self.size, dtype=bool)
+        for field, condition in filter.items():
+            if field == '$and':
+                for sub in condition:
+                    mask &= self.mask(sub, metadata)
+            elif field == '$or':
+                matched = np.zeros(self.size, dtype=bool)
+                for sub in condition:
+                    matched |= self.mask(sub, metadata)
+                mask &= matched
+            else:
+                mask &= self.field_mask(field, condition, metadata)
+        return mask
+
+
+NUMPY_MEMORY_METRICS = ('cosine', 'dot', 'l2')
+NUMPY_MEMORY_DTYPES = ('float32', 'float16', 'int8')
+
+
+class IVFIndex:
+    """Inverted-file approximate nearest-neighbour index over a NumpyMemoryImpl's rows.
+
+    Rows are partitioned into nlist clusters by k-means (spherical for the cosine metric).
+    A query scores the centroids, scans only the nprobe best clusters and ranks those rows
+    exactly, so nprobe trades recall for latency. New rows are assigned to their nearest
+    centroid as they are added, and the clusters are retrained once the memory has grown
+    retrain_factor times past the last training size. Below min_train_size rows the index
+    is not trained and the memory falls back to an exact scan.
+    """
+
+    def __init__(self, nlist: int = None, nprobe: int = 8, min_train_size: int = 2048,
+                 kmeans_iterations: int = 10, retrain_factor: float = 4.0, seed: int = 0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.kmeans_iterations = kmeans_iterations
+        self.retrain_factor = retrain_factor
+        self.rng = np.random.default_rng(seed)
+        self.centroids = None
+        self.centroid_norms = None
+        self.lists = []
+        self.list_arrays = []
+        self.trained_size = 0
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def training_vectors(self, memory, rows) -> np.ndarray:
+        vectors = memory.decode(rows)
+        if memory.metric == 'cosine':
+            return vectors / np.maximum(memory.norms[rows], 1e-12)[:, None]
+        return vectors
+
+    def assign(self, points: np.ndarray, chunk_size: int = 4096) -> np.ndarray:
+        # argmin |x - c|^2 == argmax (x.c - |c|^2 / 2), chunked to bound the score matrix.
+        bias = 0.5 * self.centroid_norms ** 2
+        return np.concatenate([
+            np.argmax(points[i:i + chunk_size] @ self.centroids.T - bias, axis=1)
+            for i in range(0, len(points), chunk_size)
+        ])
+
+    def train(self, memory) -> None:
+        nlist = self.nlist or max(1, int(np.sqrt(memory.size)))
+        nlist = min(nlist, memory.size)
+
+        sample_size = min(memory.size, 64 * nlist)
+        sample = self.rng.choice(memory.size, sample_size, replace=False)
+        points = self.training_vectors(memory, sample)
+
+        self.centroids = points[self.rng.choice(sample_size, nlist, replace=False)].copy()
+        for _ in range(self.kmeans_iterations):
+            self.centroid_norms = np.linalg.norm(self.centroids, axis=1)
+            labels = self.assign(points)
+            counts = np.bincount(labels, minlength=nlist)
+            empty = counts == 0
+            order = np.argsort(labels, kind='stable')
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            sums = np.add.reduceat(points[order], starts[~empty], axis=0)
+            self.centroids[~empty] = sums / counts[~empty, None]
+            # Reseed empty clusters with random points so every list stays useful.
+            if empty.any():
+                self.centroids[empty] = points[self.rng.choice(sample_size, int(empty.sum()), replace=False)]
+        self.centroid_norms = np.linalg.norm(self.centroids, axis=1)
+
+        self.lists = [[] for _ in range(nlist)]
+        self.list_arrays = [None] * nlist
+        self.trained_size = memory.size
+        self.assign_rows(memory, 0, memory.size)
+
+    def add(self, memory, start: int, end: int) -> None:
+        """Indexes rows [start, end) of the memory, training or retraining first when due."""
+        if not self.trained:
+            if end >= self.min_train_size:
+                self.train(memory)
+        elif end > self.retrain_factor * self.trained_size:
+            self.train(memory)
+        else:
+            self.assign_rows(memory, start, end)
+
+    def assign_rows(self, memory, start: int, end: int, chunk_size: int = 65536) -> None:
+        for chunk_start in range(start, end, chunk_size):
+            chunk_end = min(end, chunk_start + chunk_size)
+            points = self.training_vectors(memory, slice(chunk_start, chunk_end))
+            for row, label in zip(range(chunk_start, chunk_end), self.assign(points).tolist()):
+                self.lists[label].append(row)
+                self.list_arrays[label] = None
+
+    def rows(self, label: int) -> np.ndarray:
+        if self.list_arrays[label] is None:
+            self.list_arrays[label] = np.array(self.lists[label], dtype=np.int64)
+        return self.list_arrays[label]
+
+    def search(self, memory, query_vector: np.ndarray, k: int, nprobe: int = None):
+        """Returns (row indices best-first, their scores), or None if the index is not trained.
+
+        Probes the nprobe best clusters, and further clusters in order while they hold fewer
+        than k live rows (e.g. after deletes or with skewed clusters).
+        """
+        if not self.trained:
+            return None
+        nprobe = nprobe or self.nprobe
+        centroid_scores = memory.scores(self.centroids, self.centroid_norms, query_vector)
+        probed = []
+        count = 0
+        for label in memory.top_k_indices(centroid_scores, len(self.lists)):
+            if len(probed) >= nprobe and count >= k:
+                break
+            rows = memory.live_rows(self.rows(label))
+            probed.append(rows)
+            count += len(rows)
+        candidates = np.concatenate(probed)
+        if len(candidates) == 0:
+            return candidates, np.empty(0, dtype=np.float32)
+        scores = memory.row_scores(query_vector, candidates)
+        best = memory.top_k_indices(scores, min(k, len(candidates)))
+        return candidates[best], scores[best]
+
+    def compact(self, live: np.ndarray, size: int) -> None:
+        """Renumbers the lists after the memory kept only the `live` rows of its first `size`."""
+        renumbered = np.full(size, -1, dtype=np.int64)
+        renumbered[live] = np.arange(len(live))
+        for label, rows in enumerate(self.lists):
+            rows = renumbered[np.array(rows, dtype=np.int64)]
+            self.lists[label] = rows[rows >= 0].tolist()
+            self.list_arrays[label] = None
+
+
 class NumpyMemoryImpl(Memory):
-    def __init__(self, vectors=None, ids=None, metadata=None):
-        self.vectors = vectors
-        self.ids = ids
-        self.metadata = metadata
+    """In-process vector memory.
+
+    Vectors live in a preallocated, contiguous float32 buffer whose capacity doubles when
+    full, so appends are amortized O(1) and `vectors` is a view of the filled rows.
+    Row norms are computed once at insert time. query() ranks by the chosen metric and
+    returns results best-first; for 'l2' the reported similarity is the negated distance.
+    With an IVFIndex, large memories are searched approximately instead of scanned.
+
+    dtype selects the storage of the scanned vectors: 'float16' halves memory and 'int8'
+    quarters it, using a per-vector scale (max |x| / 127). Norms are always taken from the
+    original vectors. With rerank > 0, float32 originals are kept as well (in RAM, or in a
+    memory-mapped rerank_path so only the compact copy stays resident). The best
+    rerank * k quantized candidates are then re-scored exactly.
+
+    Ids are unique per namespace: adding an existing id replaces its entry. Replaced and
+    deleted rows are tombstoned and skipped by searches, and the memory is compacted once
+    more than compact_ratio of its rows are tombstones. With dedup_threshold, an entry
+    whose cosine similarity to a live entry reaches the threshold is dropped on add.
+
+    metadata_fields optionally limits the metadata fields indexed for filters (see MetadataIndex).
+    """
 
-    def query(self, query: str, n: int) -> list:
-        if self.vectors is None:
-            return []
-        if isinstance(self.vectors, list) and len(self.vectors) > 1:
-            self.vectors = np.vstack(self.vectors)
+    sorted_results = True
 
-        top_k = min(self.vectors.shape[0], n)
-        query_vector = get_ada_embedding(query)
-        similarities = self.vectors @ query_vector
-        indices = np.argpartition(similarities, -top_k)[-top_k:]
+    def __init__(self, vectors=None, ids=None, metadata=None, initial_capacity: int = 64, metric: str = 'cosine',
+                 index: IVFIndex = None, dtype: str = 'float32', rerank: int = 0, rerank_path: str = None,
+                 dedup_threshold: float = None, compact_ratio: float = 0.25, metadata_fields: list = None):
+        if metric not in NUMPY_MEMORY_METRICS:
+            raise Exception(f"Unknown metric {metric}, expected one of {NUMPY_MEMORY_METRICS}")
+        if dtype not in NUMPY_MEMORY_DTYPES:
+            raise Exception(f"Unknown dtype {dtype}, expected one of {NUMPY_MEMORY_DTYPES}")
+        self.metric = metric
+        self.index = index
+        self.dtype = np.dtype(dtype)
+        self.rerank = rerank
+        self.rerank_path = rerank_path
+        self.buffer = None
+        self.norms_buffer = None
+        self.scales_buffer = None
+        self.exact_buffer = None
+        self.size = 0
+        self.initial_capacity = initial_capacity
+        self.ids = list(ids) if ids is not None else []
+        self.metadata = list(metadata) if metadata is not None else []
+        self.namespaces = [None] * len(self.ids)
+        self.metadata_index = None
+        self.metadata_fields = metadata_fields
+        self.dedup_threshold = dedup_threshold
+        self.compact_ratio = compact_ratio
+        self.deleted_buffer = None
+        self.deleted_count = 0
+        self.id_rows = None
+        # Context prefetches query on pool threads while results are added, and compaction
+        # moves rows, so every read and write of the rows holds this lock. A persistent
+        # memory re-initialized by compact() keeps the lock it holds.
+        self.lock = getattr(self, 'lock', None) or threading.RLock()
+        if vectors is not None and len(vectors) > 0:
+            self.append_vectors(np.vstack(vectors))
+
+    @property
+    def vectors(self):
+        if self.buffer is None:
+            return None
+        return self.buffer[:self.size]
+
+    @property
+    def norms(self):
+        if self.norms_buffer is None:
+            return None
+        return self.norms_buffer[:self.size]
+
+    def reserve(self, rows: int, dim: int) -> None:
+        if self.buffer is None:
+            self.resize(max(self.initial_capacity, rows), dim)
+        elif rows > self.buffer.shape[0]:
+            capacity = self.buffer.shape[0]
+            while capacity < rows:
+                capacity *= 2
+            self.resize(capacity, dim)
+
+    def resize(self, capacity: int, dim: int) -> None:
+        self.buffer = grow_rows(self.buffer, self.size, capacity, (dim,), self.dtype)
+        self.norms_buffer = grow_rows(self.norms_buffer, self.size, capacity, (), np.float32)
+        if self.dtype == np.int8:
+            self.scales_buffer = grow_rows(self.scales_buffer, self.size, capacity, (), np.float32)
+        if self.rerank:
+            if self.rerank_path:
+                if self.exact_buffer is not None:
+                    self.exact_buffer.flush()
+                self.exact_buffer = map_rows(self.rerank_path, capacity, (dim,), np.float32)
+            else:
+                self.exact_buffer = grow_rows(self.exact_buffer, self.size, capacity, (dim,), np.float32)
+
+    def append_vectors(self, vectors) -> None:
+        with self.lock:
+            vectors = np.asarray(vectors, dtype=np.float32).reshape((-1, np.shape(vectors)[-1]))
+            self.reserve(self.size + vectors.shape[0], vectors.shape[1])
+            rows = slice(self.size, self.size + vectors.shape[0])
+            if self.dtype == np.int8:
+                scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127
+                self.scales_buffer[rows] = scales
+                self.buffer[rows] = np.round(vectors / scales[:, None])
+            else:
+                self.buffer[rows] = vectors
+            if self.exact_buffer is not None:
+                self.exact_buffer[rows] = vectors
+            self.norms_buffer[rows] = np.linalg.norm(vectors, axis=1)
+            self.size += vectors.shape[0]
+            if self.index is not None:
+                self.index.add(self, self.size - vectors.shape[0], self.size)
+
+    @property
+    def scales(self):
+        if self.scales_buffer is None:
+            return None
+        return self.scales_buffer[:self.size]
+
+    def decode(self, rows) -> np.ndarray:
+        """float32 copies of the given stored rows (a slice or index array)."""
+        vectors = self.vectors[rows].astype(np.float32)
+        if self.dtype == np.int8:
+            vectors *= self.scales[rows][:, None]
+        return vectors
+
+    @property
+    def deleted(self):
+        """Boolean tombstone mask over the filled rows, or None when nothing is deleted."""
+        if self.deleted_count == 0:
+            return None
+        return self.tombstones()
+
+    def tombstones(self) -> np.ndarray:
+        # Grown lazily and zero-filled, so rows appended since the last delete are live.
+        if self.deleted_buffer is None:
+            self.deleted_buffer = np.zeros(max(self.size, 1), dtype=bool)
+        elif len(self.deleted_buffer) < self.size:
+            grown = np.zeros(max(self.size, 2 * len(self.deleted_buffer)), dtype=bool)
+            grown[:len(self.deleted_buffer)] = self.deleted_buffer
+            self.deleted_buffer = grown
+        return self.deleted_buffer[:self.size]
+
+    def live_rows(self, rows: np.ndarray) -> np.ndarray:
+        deleted = self.deleted
+        return rows if deleted is None else rows[~deleted[rows]]
+
+    def mark_deleted(self, rows) -> None:
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) == 0:
+            return
+        tombstones = self.tombstones()
+        rows = np.unique(rows[~tombstones[rows]])
+        tombstones[rows] = True
+        self.deleted_count += len(rows)
+        self.record_deleted(rows)
+
+    def record_deleted(self, rows: np.ndarray) -> None:
+        """Hook for storing new tombstones; in-process memories keep only the mask."""
+        pass
+
+    def row_key(self, namespace: str, vector_id):
+        return (namespace, vector_id)
+
+    def row_index(self) -> dict:
+        """row_key(namespace, id) -> live row, built on first write. Older duplicates are tombstoned."""
+        if self.id_rows is None:
+            self.id_rows = {}
+            deleted = self.deleted
+            duplicates = []
+            for row, (vector_id, namespace) in enumerate(zip(self.ids, self.namespaces)):
+                if deleted is not None and deleted[row]:
+                    continue
+                key = self.row_key(namespace, vector_id)
+                previous = self.id_rows.get(key)
+                if previous is not None:
+                    duplicates.append(previous)
+                self.id_rows[key] = row
+            self.mark_deleted(duplicates)
+        return self.id_rows
+
+    def near_duplicates(self, vectors: np.ndarray) -> np.ndarray:
+        """Mask of vectors whose cosine similarity to a live row, or to an earlier vector of
+        the batch, reaches dedup_threshold."""
+        norms = np.maximum(np.linalg.norm(vectors, axis=1), 1e-12)
+        duplicates = np.zeros(len(vectors), dtype=bool)
+        if self.size > 0:
+            similarities = self.row_dots(vectors.T) / np.maximum(self.norms, 1e-12)[:, None] / norms
+            if self.deleted is not None:
+                similarities[self.deleted] = -np.inf
+            duplicates |= similarities.max(axis=0) >= self.dedup_threshold
+        if len(vectors) > 1:
+            similarities = (vectors @ vectors.T) / norms[:, None] / norms
+            for i in range(1, len(vectors)):
+                kept = np.flatnonzero(~duplicates[:i])
+                duplicates[i] |= bool((similarities[i, kept] >= self.dedup_threshold).any())
+        return duplicates
+
+    def compact(self) -> None:
+        """Drops tombstoned rows, moving live rows down in place."""
+        with self.lock:
+            deleted = self.deleted
+            if deleted is None:
+                return
+            live = np.flatnonzero(~deleted)
+            size = self.size
+            for buffer in (self.buffer, self.norms_buffer, self.scales_buffer, self.exact_buffer):
+                if buffer is not None:
+                    buffer[:len(live)] = buffer[live]
+            self.ids = [self.ids[row] for row in live]
+            self.metadata = [self.metadata[row] for row in live]
+            self.namespaces = [self.namespaces[row] for row in live]
+            self.size = len(live)
+            self.deleted_buffer = None
+            self.deleted_count = 0
+            self.id_rows = None
+            self.metadata_index = None
+            if self.index is not None and self.index.trained:
+                self.index.compact(live, size)
+
+    def maybe_compact(self) -> None:
+        if self.compact_ratio is not None and self.deleted_count > self.compact_ratio * self.size:
+            self.compact()
+
+    def row_dots(self, queries: np.ndarray, rows=None, exact: bool = False, chunk_size: int = 1024) -> np.ndarray:
+        """Dot products of stored rows (all, or the given row indices) with a query vector of
+        shape (dim,), or with several queries at once given as a (dim, m) matrix."""
+        if exact and self.exact_buffer is not None:
+            source = self.exact_buffer[:self.size]
+            return (source if rows is None else source[rows]) @ queries
+        vectors = self.vectors if rows is None else self.vectors[rows]
+        if self.dtype == np.float32:
+            return vectors @ queries
+        if self.dtype == np.int8 and queries.ndim == 1:
+            # einsum widens int8 on the fly without materializing a float32 copy of the matrix.
+            scales = self.scales if rows is None else self.scales[rows]
+            return np.einsum('ij,j->i', vectors, queries) * scales
+
+        # NumPy has no fast float16 kernel (and matrix products are compute bound), so widen
+        # in small cache-friendly chunks and use BLAS.
+        dots = np.empty((len(vectors),) + queries.shape[1:], dtype=np.float32)
+        for start in range(0, len(vectors), chunk_size):
+            dots[start:start + chunk_size] = vectors[start:start + chunk_size].astype(np.float32) @ queries
+        if self.dtype == np.int8:
+            scales = self.scales if rows is None else self.scales[rows]
+            dots *= scales[:, None]
+        return dots
+
+    def row_scores(self, queries: np.ndarray, rows=None, exact: bool = False) -> np.ndarray:
+        norms = self.norms if rows is None else self.norms[rows]
+        return self.score_dots(self.row_dots(queries, rows, exact), norms, queries)
+
+    def scores(self, vectors, norms, query_vector) -> np.ndarray:
+        return self.score_dots(vectors @ query_vector, norms, query_vector)
+
+    def score_dots(self, dots, norms, queries) -> np.ndarray:
+        """Higher is better for every metric. dots is (rows,) for one query or (rows, m) for m."""
+        if self.metric == 'dot':
+            return dots
+        if dots.ndim == 2:
+            norms = norms[:, None]
+        query_norm = np.linalg.norm(queries, axis=0)
+        if self.metric == 'cosine':
+            return dots / np.maximum(norms * query_norm, 1e-12)
+        # Squared L2 distance from the cached norms: |v|^2 - 2 v.q + |q|^2
+        return -np.sqrt(np.maximum(norms * norms - 2 * dots + query_norm * query_norm, 0))
+
+    @staticmethod
+    def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+        """Indices of the k best scores, best first: argpartition, then sort only the k candidates."""
+        if k < len(scores):
+            candidates = np.argpartition(scores, -k)[-k:]
+        else:
+            candidates = np.arange(len(scores))
+        return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+    def filter_rows(self, filter: dict = None, namespace: str = None) -> np.ndarray:
+        """Row indices matching a metadata filter and/or namespace, using the metadata index."""
+        with self.lock:
+            if self.metadata_index is None:
+                # Built on first use, then kept up to date by append().
+                self.metadata_index = MetadataIndex(self.metadata_fields)
+                self.metadata_index.add(self.metadata, self.namespaces)
+            if namespace is not None:
+                filter = dict(filter or {}, **{NAMESPACE_FIELD: namespace})
+            mask = self.metadata_index.mask(filter, self.metadata)
+            if self.deleted is not None:
+                mask &= ~self.deleted
+            return np.flatnonzero(mask)
+
+    def search(self, query_vector: np.ndarray, k: int, exact: bool = False, rows: np.ndarray = None):
+        """Returns (row indices best-first, their scores) for a query vector.
+
+        exact=True skips the ANN index and scores against the float32 originals when kept.
+        rows restricts the search to those row indices (e.g. from filter_rows) with a direct scan.
+        """
+        with self.lock:
+            if self.size == self.deleted_count or (rows is not None and len(rows) == 0):
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            query_vector = np.asarray(query_vector, dtype=np.float32)
+            rerank = self.rerank and self.exact_buffer is not None and not exact
+            candidates_k = k * self.rerank if rerank else k
+
+            found = None
+            if rows is not None:
+                similarities = self.row_scores(query_vector, rows, exact=exact)
+                best = self.top_k_indices(similarities, min(len(rows), candidates_k))
+                found = rows[best], similarities[best]
+            elif self.index is not None and not exact:
+                found = self.index.search(self, query_vector, candidates_k)
+            if found is None:
+                similarities = self.row_scores(query_vector, exact=exact)
+                deleted = self.deleted
+                if deleted is not None:
+                    similarities[deleted] = -np.inf
+                indices = self.top_k_indices(similarities, min(self.size - self.deleted_count, candidates_k))
+                found = indices, similarities[indices]
+
+            if rerank:
+                indices = found[0]
+                similarities = self.row_scores(query_vector, indices, exact=True)
+                best = self.top_k_indices(similarities, min(len(indices), k))
+                found = indices[best], similarities[best]
+            return found
+
+    def search_many(self, query_vectors, k: int, exact: bool = False, rows: np.ndarray = None,
+                    max_scores: int = 1 << 24) -> list:
+        """search() for a batch of query vectors with one matrix-matrix product per chunk.
+
+        Queries are chunked so the score matrix stays under max_scores entries. With a
+        trained ANN index each query goes through the index instead.
+        """
+        with self.lock:
+            query_vectors = np.atleast_2d(np.asarray(query_vectors, dtype=np.float32))
+            if (self.index is not None and self.index.trained and not exact and rows is None) or self.size == 0:
+                return [self.search(query_vector, k, exact=exact, rows=rows) for query_vector in query_vectors]
+
+            deleted = self.deleted if rows is None else None
+            count = self.size if rows is None else len(rows)
+            live_count = count - (self.deleted_count if deleted is not None else 0)
+            if live_count == 0:
+                return [self.search(query_vector, k, rows=rows) for query_vector in query_vectors]
+            rerank = self.rerank and self.exact_buffer is not None and not exact
+            candidates_k = min(live_count, k * self.rerank if rerank else k)
+            chunk = max(1, max_scores // count)
+
+            results = []
+            for start in range(0, len(query_vectors), chunk):
+                queries = query_vectors[start:start + chunk].T
+                similarities = self.row_scores(queries, rows, exact=exact)
+                if deleted is not None:
+                    similarities[deleted] = -np.inf
+                if candidates_k < count:
+                    candidates = np.argpartition(-similarities, candidates_k - 1, axis=0)[:candidates_k]
+                else:
+                    candidates = np.broadcast_to(np.arange(count)[:, None], similarities.shape)
+                candidate_scores = np.take_along_axis(similarities, candidates, axis=0)
+                order = np.argsort(-candidate_scores, axis=0, kind='stable')
+                candidates = np.take_along_axis(candidates, order, axis=0)
+                candidate_scores = np.take_along_axis(candidate_scores, order, axis=0)
+                for column in range(queries.shape[1]):
+                    indices = candidates[:, column] if rows is None else rows[candidates[:, column]]
+                    found = indices, candidate_scores[:, column]
+                    if rerank:
+                        exact_scores = self.row_scores(queries[:, column], indices, exact=True)
+                        best = self.top_k_indices(exact_scores, min(len(indices), k))
+                        found = indices[best], exact_scores[best]
+                    results.append(found)
+            return results
+
+    def results(self, indices, similarities) -> list:
         return [
             NumpyQueryResult(
                 self.ids[i],
-                similarities[i],
+                similarity,
                 self.metadata[i]
             )
-            for i in indices
+            for i, similarity in zip(indices, similarities)
         ]
 
-    def add(self, vector_id: str, text: str, metadata: dict) -> None:
-        if isinstance(self.vectors, list) and len(self.vectors) > 1:
-            self.vectors = np.vstack(self.vectors)
+    def query(self, query: str, n: int, filter: dict = None, namespace: str = None) -> list:
+        if self.size == 0:
+            return []
 
-        if self.vectors is None:
-            self.vectors = np.array(get_ada_embedding(text)).reshape((1, -1))
-            self.ids = [vector_id]
-            self.metadata = [metadata]
-        else:
-            self.ids.append(vector_id)
-            self.vectors = np.vstack([self.vectors, np.array(get_ada_embedding(text))])
-            self.metadata.append(metadata)
+        query_vector = get_ada_embedding(query)
+        with self.lock:
+            rows = self.filter_rows(filter, namespace) if filter or namespace is not None else None
+            indices, similarities = self.search(query_vector, n, rows=rows)
+            return self.results(indices, similarities)
+
+    def query_many(self, queries: list, n: int, filter: dict = None, namespace: str = None) -> list:
+        if self.size == 0:
+            return [[] for _ in queries]
+
+        query_vectors = np.vstack(get_ada_embeddings(queries))
+        with self.lock:
+            rows = self.filter_rows(filter, namespace) if filter or namespace is not None else None
+            found = self.search_many(query_vectors, n, rows=rows)
+            return [self.results(indices, similarities) for indices, similarities in found]
+
+    def add(self, vector_id: str, text: str, metadata: dict, namespace: str = None) -> None:
+        self.append([vector_id], get_ada_embedding(text), [metadata], [namespace])
+
+    def add_many(self, ids: list, texts: list, metadatas: list, namespace: str = None) -> None:
+        if len(ids) == 0:
+            return
+        self.append(list(ids), np.vstack(get_ada_embeddings(texts)), list(metadatas), [namespace] * len(ids))
+
+    def delete(self, ids: list, namespace: str = None) -> None:
+        with self.lock:
+            id_rows = self.row_index()
+            keys = [self.row_key(namespace, vector_id) for vector_id in ids]
+            self.mark_deleted([id_rows.pop(key) for key in keys if key in id_rows])
+            self.version += 1
+            self.maybe_compact()
+
+    def append(self, ids: list, vectors, metadatas: list, namespaces: list = None) -> None:
+        """Adds entries, replacing live entries with the same namespace and id."""
+        with self.lock:
+            namespaces = namespaces if namespaces is not None else [None] * len(ids)
+            vectors = np.asarray(vectors, dtype=np.float32).reshape((len(ids), -1))
+            id_rows = self.row_index()
+            if self.dedup_threshold is not None:
+                # Replacing an existing id is an explicit update, so it is never dropped as a duplicate.
+                keep = ~self.near_duplicates(vectors)
+                keep |= np.array([self.row_key(namespace, vector_id) in id_rows for vector_id, namespace in zip(ids, namespaces)])
+                if not keep.all():
+                    ids, metadatas, namespaces = ([x for x, kept in zip(xs, keep) if kept] for xs in (ids, metadatas, namespaces))
+                    vectors = vectors[keep]
+                if len(ids) == 0:
+                    return
+
+            replaced = []
+            for offset, key in enumerate(self.row_key(namespace, vector_id) for namespace, vector_id in zip(namespaces, ids)):
+                previous = id_rows.get(key)
+                if previous is not None:
+                    replaced.append(previous)
+                id_rows[key] = self.size + offset
+            self.store(ids, vectors, metadatas, namespaces)
+            self.mark_deleted(replaced)
+            self.version += 1
+            self.maybe_compact()
+
+    def store(self, ids: list, vectors, metadatas: list, namespaces: list) -> None:
+        self.append_vectors(vectors)
+        self.ids.extend(ids)
+        self.metadata.extend(metadatas)
+        self.namespaces.extend(namespaces)
+        if self.metadata_index is not None:
+            self.metadata_index.add(metadatas, namespaces)
+
+
+class JsonlSidecar:
+    """Append-only JSONL file of entries with a binary offset index (one uint64 per row).
+
+    An entry is committed once its offset is written, which happens after the JSON line
+    itself is flushed. On open, a torn trailing offset or line left by a crash is dropped.
+    Entries are read lazily by offset, so opening does not parse the file.
+    """
+
+    def __init__(self, directory: str, sync: bool = True, cache_size: int = 1024):
+        self.entries_path = os.path.join(directory, "entries.jsonl")
+        self.offsets_path = os.path.join(directory, "offsets.u64")
+        self.sync = sync
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+        for path in (self.entries_path, self.offsets_path):
+            open(path, "ab").close()
+
+        self.offsets = array.array('Q')
+        with open(self.offsets_path, "rb") as f:
+            data = f.read()
+        self.offsets.frombytes(data[:len(data) - len(data) % 8])
+
+        self.reader = open(self.entries_path, "rb")
+        while len(self.offsets) > 0 and self.read_line(self.offsets[-1]) is None:
+            self.offsets.pop()
+
+        self.offsets_file = open(self.offsets_path, "r+b")
+        self.offsets_file.truncate(len(self.offsets) * 8)
+        self.offsets_file.seek(0, os.SEEK_END)
+        self.entries_file = open(self.entries_path, "ab")
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def read_line(self, offset: int):
+        self.reader.seek(offset)
+        line = self.reader.readline()
+        if not line.endswith(b"\n"):
+            return None
+        try:
+            return json.loads(line)
+        except ValueError:
+            return None
+
+    def get(self, row: int) -> dict:
+        row = int(row)
+        with self.lock:
+            entry = self.cache.get(row)
+            if entry is None:
+                entry = self.read_line(self.offsets[row])
+                self.cache[row] = entry
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+            else:
+                self.cache.move_to_end(row)
+            return entry
+
+    def append(self, entries: list) -> None:
+        with self.lock:
+            offset = self.entries_file.seek(0, os.SEEK_END)
+            offsets = array.array('Q')
+            lines = []
+            for entry in entries:
+                line = (json.dumps(entry, default=str) + "\n").encode("utf-8")
+                offsets.append(offset)
+                lines.append(line)
+                offset += len(line)
+            self.entries_file.write(b"".join(lines))
+            self.entries_file.flush()
+            if self.sync:
+                os.fsync(self.entries_file.fileno())
+
+            self.offsets_file.write(offsets.tobytes())
+            self.offsets_file.flush()
+            if self.sync:
+                os.fsync(self.offsets_file.fileno())
+            self.offsets.extend(offsets)
+
+    def close(self) -> None:
+        for f in (self.reader, self.entries_file, self.offsets_file):
+            f.close()
+
+
+class SidecarField:
+    """Read-only sequence view of one field of a JsonlSidecar, indexed by row."""
+
+    def __init__(self, sidecar: JsonlSidecar, field: str):
+        self.sidecar = sidecar
+        self.field = field
+
+    def __len__(self) -> int:
+        return len(self.sidecar)
+
+    def __getitem__(self, row):
+        return self.sidecar.get(row).get(self.field)
+
+    def __iter__(self):
+        for row in range(len(self.sidecar)):
+            yield self[row]
+
+
+class PersistentNumpyMemoryImpl(NumpyMemoryImpl):
+    """NumpyMemoryImpl stored in a directory so it survives restarts.
+
+    Vectors and their norms are raw float32 files opened with np.memmap, so opening a
+    multi-GB memory only maps it and pages are read on demand. Ids and metadata are kept in
+    an append-only JsonlSidecar, which also decides how many rows are committed: vectors
+    are flushed before their sidecar entry, so a crash mid-append leaves at most an
+    uncommitted vector row that the next append overwrites. Vectors are stored as float32.
+
+    Tombstoned rows are appended to deleted.u64. Compaction rewrites the live rows into a
+    new directory that replaces the old one, so it only runs automatically when
+    compact_ratio is set; compact() can also be called explicitly.
+
+    keys.u64 holds a 64-bit hash of (namespace, id) per row, written with the vectors, so
+    the id lookup needed by the first add is built without reading the sidecar.
+    """
+
+    def __init__(self, path: str, metric: str = 'cosine', index: IVFIndex = None, sync: bool = True,
+                 initial_capacity: int = 1024, dedup_threshold: float = None, compact_ratio: float = None,
+                 metadata_fields: list = None):
+        super().__init__(initial_capacity=initial_capacity, metric=metric, index=index,
+                         dedup_threshold=dedup_threshold, compact_ratio=compact_ratio, metadata_fields=metadata_fields)
+        # Finish or roll back a compaction interrupted between its directory renames.
+        if os.path.exists(path + ".old"):
+            if os.path.exists(path):
+                shutil.rmtree(path + ".old")
+            else:
+                os.rename(path + ".old", path)
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.sync = sync
+        self.initial_capacity = initial_capacity
+        self.vectors_path = os.path.join(path, "vectors.f32")
+        self.norms_path = os.path.join(path, "norms.f32")
+        self.header_path = os.path.join(path, "header.json")
+        self.deleted_path = os.path.join(path, "deleted.u64")
+        self.keys_path = os.path.join(path, "keys.u64")
+
+        self.dim = None
+        if os.path.exists(self.header_path):
+            with open(self.header_path) as f:
+                header = json.load(f)
+            self.dim = header['dim']
+            if header['metric'] != metric:
+                print(f"Memory at {path} was created with metric {header['metric']}, using it instead of {metric}")
+                self.metric = header['metric']
+
+        self.sidecar = JsonlSidecar(path, sync=sync)
+        self.ids = SidecarField(self.sidecar, 'id')
+        self.metadata = SidecarField(self.sidecar, 'metadata')
+        self.namespaces = SidecarField(self.sidecar, 'namespace')
+        self.size = len(self.sidecar)
+        if self.dim is not None:
+            self.resize(max(self.size, os.path.getsize(self.vectors_path) // (4 * self.dim)), self.dim)
+
+        deleted = array.array('Q')
+        if os.path.exists(self.deleted_path):
+            with open(self.deleted_path, "rb") as f:
+                data = f.read()
+            deleted.frombytes(data[:len(data) - len(data) % 8])
+        deleted = np.array(deleted, dtype=np.int64)
+        deleted = np.unique(deleted[deleted < self.size])
+        if len(deleted) > 0:
+            self.tombstones()[deleted] = True
+            self.deleted_count = len(deleted)
+        self.deleted_file = open(self.deleted_path, "ab")
+
+        # Keys past the committed rows belong to an interrupted append.
+        open(self.keys_path, "ab").close()
+        self.keys_file = open(self.keys_path, "r+b")
+        key_count = os.path.getsize(self.keys_path) // 8
+        self.keys_file.truncate(min(key_count, self.size) * 8)
+        if key_count < self.size:
+            # Memories written before keys.u64 existed are backfilled once.
+            self.write_keys(key_count, [self.row_key(self.namespaces[row], self.ids[row])
+                                        for row in range(key_count, self.size)])
+
+        if self.index is not None and self.size > 0:
+            self.index.add(self, 0, self.size)
+
+    def resize(self, capacity: int, dim: int) -> None:
+        if self.dim is None:
+            self.dim = dim
+            with open(self.header_path + ".tmp", "w") as f:
+                json.dump({'dim': dim, 'metric': self.metric}, f)
+            os.replace(self.header_path + ".tmp", self.header_path)
+        if self.buffer is not None:
+            self.buffer.flush()
+            self.norms_buffer.flush()
+        self.buffer = map_rows(self.vectors_path, capacity, (dim,), np.float32)
+        self.norms_buffer = map_rows(self.norms_path, capacity, (), np.float32)
+
+    def row_key(self, namespace: str, vector_id) -> int:
+        # Hashed as stored in the sidecar, so an id reads back to the same key after a reopen.
+        data = json.dumps([namespace, vector_id], default=str).encode("utf-8")
+        return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+    def write_keys(self, start: int, keys: list) -> None:
+        """Writes the keys of rows start onwards, dropping any left by a failed append."""
+        self.keys_file.seek(start * 8)
+        self.keys_file.write(array.array('Q', keys).tobytes())
+        self.keys_file.truncate()
+        self.keys_file.flush()
+        if self.sync:
+            os.fsync(self.keys_file.fileno())
+
+    def row_index(self) -> dict:
+        if self.id_rows is None:
+            keys = np.fromfile(self.keys_path, dtype=np.uint64, count=self.size)
+            rows = np.arange(self.size)
+            if self.deleted is not None:
+                rows = rows[~self.deleted]
+            # The last live row of each key wins; earlier ones are stale duplicates.
+            reversed_keys = keys[rows][::-1]
+            _, first = np.unique(reversed_keys, return_index=True)
+            latest = np.zeros(len(rows), dtype=bool)
+            latest[len(rows) - 1 - first] = True
+            self.id_rows = dict(zip(keys[rows[latest]].tolist(), rows[latest].tolist()))
+            self.mark_deleted(rows[~latest])
+        return self.id_rows
+
+    def store(self, ids: list, vectors, metadatas: list, namespaces: list) -> None:
+        self.append_vectors(vectors)
+        self.buffer.flush()
+        self.norms_buffer.flush()
+        self.write_keys(len(self.sidecar), [self.row_key(namespace, vector_id) for vector_id, namespace in zip(ids, namespaces)])
+        self.sidecar.append([
+            {'id': vector_id, 'metadata': metadata, 'namespace': namespace}
+            for vector_id, metadata, namespace in zip(ids, metadatas, namespaces)
+        ])
+        if self.metadata_index is not None:
+            self.metadata_index.add(metadatas, namespaces)
+
+    def record_deleted(self, rows: np.ndarray) -> None:
+        self.deleted_file.write(array.array('Q', rows.tolist()).tobytes())
+        self.deleted_file.flush()
+        if self.sync:
+            os.fsync(self.deleted_file.fileno())
+
+    def compact(self, chunk_size: int = 65536) -> None:
+        """Rewrites the live rows into a fresh directory and swaps it in place of this one."""
+        with self.lock:
+            deleted = self.deleted
+            if deleted is None:
+                return
+            live = np.flatnonzero(~deleted)
+            size = self.size
+            staging = self.path + ".compact"
+            shutil.rmtree(staging, ignore_errors=True)
+            compacted = PersistentNumpyMemoryImpl(staging, metric=self.metric, sync=self.sync)
+            for start in range(0, len(live), chunk_size):
+                rows = live[start:start + chunk_size]
+                compacted.store(
+                    [self.ids[row] for row in rows],
+                    self.vectors[rows],
+                    [self.metadata[row] for row in rows],
+                    [self.namespaces[row] for row in rows]
+                )
+            compacted.close()
+            self.close()
+
+            os.rename(self.path, self.path + ".old")
+            os.rename(staging, self.path)
+            shutil.rmtree(self.path + ".old")
+
+            index = self.index
+            self.__init__(self.path, metric=self.metric, sync=self.sync, initial_capacity=self.initial_capacity,
+                          dedup_threshold=self.dedup_threshold, compact_ratio=self.compact_ratio,
+                          metadata_fields=self.metadata_fields)
+            if index is not None and index.trained:
+                index.compact(live, size)
+            self.index = index
+
+    def close(self) -> None:
+        if self.buffer is not None:
+            self.buffer.flush()
+            self.norms_buffer.flush()
+        self.sidecar.close()
+        self.deleted_file.close()
+        self.keys_file.close()
 
 
 @xai_component
 class NumpyMemory(Component):
+    """In-process vector memory backed by NumPy.
+
+    #### inPorts:
+    - path: Optional directory to persist the memory in. An existing memory there is reopened.
+    - metric: Similarity metric, one of 'cosine' (default), 'dot' or 'l2'.
+    - index: 'flat' (default) for an exact scan or 'ivf' for an approximate IVF index.
+    - nlist: Number of IVF clusters. Defaults to sqrt(size) at training time.
+    - nprobe: Number of IVF clusters scanned per query. Higher is slower with better recall. Defaults to 8.
+    - min_index_size: Below this many entries queries use the exact scan. Defaults to 2048.
+    - dtype: In-memory vector storage, 'float32' (default), 'float16' or 'int8'.
+    - rerank: With a quantized dtype, re-score this many times k candidates against float32 originals. 0 disables it.
+    - rerank_path: File the float32 originals for rerank are memory-mapped from, so only the quantized vectors stay in RAM. Required with rerank.
+    - dedup_threshold: Optional cosine similarity at or above which a new entry is dropped as a near-duplicate.
+    - compact_ratio: Fraction of replaced or deleted rows that triggers compaction. Defaults to 0.25 in memory
+      and to no automatic compaction for a persistent memory.
+    - metadata_fields: Optional list of the metadata fields filters use, e.g. ["task_id"]. Only these are indexed;
+      filters on other fields scan the metadata. Defaults to every field with short scalar values.
+
+    #### outPorts:
+    - memory: The memory.
+    """
+
+    path: InArg[str]
+    metric: InArg[str]
+    index: InArg[str]
+    nlist: InArg[int]
+    nprobe: InArg[int]
+    min_index_size: InArg[int]
+    dtype: InArg[str]
+    rerank: InArg[int]
+    rerank_path: InArg[str]
+    dedup_threshold: InArg[float]
+    compact_ratio: InArg[float]
+    metadata_fields: InArg[list]
     memory: OutArg[Memory]
 
     def execute(self, ctx) -> None:
-        self.memory.value = NumpyMemoryImpl()
+        index = None
+        if self.index.value == 'ivf':
+            index = IVFIndex(
+                nlist=self.nlist.value,
+                nprobe=self.nprobe.value or 8,
+                min_train_size=self.min_index_size.value or 2048
+            )
+        elif self.index.value not in (None, 'flat'):
+            raise Exception(f"Unknown index {self.index.value}, expected 'flat' or 'ivf'")
+        if self.path.value:
+            if self.dtype.value not in (None, 'float32') or self.rerank.value:
+                raise Exception("Persistent NumpyMemory stores float32 vectors, dtype and rerank are not supported")
+            self.memory.value = PersistentNumpyMemoryImpl(
+                self.path.value,
+                metric=self.metric.value or 'cosine',
+                index=index,
+                dedup_threshold=self.dedup_threshold.value,
+                compact_ratio=self.compact_ratio.value,
+                metadata_fields=self.metadata_fields.value
+            )
+        elif self.rerank.value and not self.rerank_path.value:
+            # Keeping the originals in RAM next to the quantized copy would use more memory than float32 alone.
+            raise Exception("rerank needs a rerank_path to memory-map the float32 originals from")
+        else:
+            self.memory.value = NumpyMemoryImpl(
+                metric=self.metric.value or 'cosine',
+                index=index,
+                dtype=self.dtype.value or 'float32',
+                rerank=self.rerank.value or 0,
+                rerank_path=self.rerank_path.value,
+                dedup_threshold=self.dedup_threshold.value,
+                compact_ratio=self.compact_ratio.value if self.compact_ratio.value is not None else 0.25,
+                metadata_fields=self.metadata_fields.value
+            )
 
 
 @xai_component
@@ -1028,6 +4388,126 @@ class PineconeMemory(Component):
         self.memory.value = PineconeMemoryImpl(index, self.namespace.value)
 
 
+@xai_component
+class ConfigureLLMClient(Component):
+    """Configures the shared connection pool used by every LLM call in this process.
+    Unset values fall back to the LLM_CLIENT_* environment variables.
+
+    #### inPorts:
+    - max_connections: Maximum number of concurrent connections per client.
+    - max_keepalive: Maximum number of idle connections kept alive per client.
+    - keepalive_expiry: Seconds an idle connection is kept before it is closed.
+    - timeout: Request timeout in seconds.
+    - connect_timeout: Connection timeout in seconds.
+    """
+
+    max_connections: InArg[int]
+    max_keepalive: InArg[int]
+    keepalive_expiry: InArg[float]
+    timeout: InArg[float]
+    connect_timeout: InArg[float]
+
+    def execute(self, ctx) -> None:
+        llm_clients.configure(
+            max_connections=self.max_connections.value,
+            max_keepalive=self.max_keepalive.value,
+            keepalive_expiry=self.keepalive_expiry.value,
+            timeout=self.timeout.value,
+            connect_timeout=self.connect_timeout.value
+        )
+
+
+@xai_component
+class CreateRetryPolicy(Component):
+    """Creates a retry policy (exponential backoff with jitter) for the LLM calls made by agents and tools.
+
+    #### inPorts:
+    - max_attempts: Maximum number of attempts per call, including the first one.
+    - base_delay: Backoff in seconds before the first retry; doubles on every retry.
+    - max_delay: Upper bound in seconds for a single backoff.
+    - deadline: Total seconds a call may spend retrying before the error is raised.
+
+    #### outPorts:
+    - retry_policy: The retry policy.
+    """
+
+    max_attempts: InArg[int]
+    base_delay: InArg[float]
+    max_delay: InArg[float]
+    deadline: InArg[float]
+    retry_policy: OutArg[RetryPolicy]
+
+    def execute(self, ctx) -> None:
+        self.retry_policy.value = RetryPolicy(
+            max_attempts=self.max_attempts.value if self.max_attempts.value is not None else 6,
+            base_delay=self.base_delay.value if self.base_delay.value is not None else 1.0,
+            max_delay=self.max_delay.value if self.max_delay.value is not None else 60.0,
+            deadline=self.deadline.value if self.deadline.value is not None else 300.0
+        )
+
+
+@xai_component
+class EnableLLMCache(Component):
+    """Enables the process-wide LLM response cache used by every agent and tool.
+    Identical calls (same model, prompt, temperature and max_tokens) are answered from the cache.
+
+    #### inPorts:
+    - path: Optional SQLite file that persists the cache across runs.
+    - max_memory_entries: Size of the in-memory LRU. Defaults to 1024.
+    - max_disk_entries: Maximum number of responses kept in the SQLite file. Defaults to 100000.
+    - ttl: Optional time-to-live in seconds for cached responses.
+    - only_deterministic: Only cache calls made with temperature 0.
+
+    #### outPorts:
+    - cache: The cache, whose `stats()` reports hits, misses and evictions.
+    """
+
+    path: InArg[str]
+    max_memory_entries: InArg[int]
+    max_disk_entries: InArg[int]
+    ttl: InArg[float]
+    only_deterministic: InArg[bool]
+    cache: OutArg[LLMResponseCache]
+
+    def execute(self, ctx) -> None:
+        cache = LLMResponseCache(
+            path=self.path.value,
+            max_memory_entries=self.max_memory_entries.value if self.max_memory_entries.value is not None else 1024,
+            max_disk_entries=self.max_disk_entries.value if self.max_disk_entries.value is not None else 100000,
+            ttl=self.ttl.value,
+            only_deterministic=bool(self.only_deterministic.value)
+        )
+        set_llm_cache(cache)
+        self.cache.value = cache
+
+
+@xai_component
+class EnableEmbeddingCache(Component):
+    """Replaces the process-wide embedding cache consulted by NumpyMemory and PineconeMemory.
+    An in-memory cache is always active; set a path to also keep the vectors on disk between runs.
+    VectoMemory embeds on the Vecto server and does not use this cache.
+
+    #### inPorts:
+    - path: Optional SQLite file that stores the float32 vectors.
+    - max_memory_entries: Size of the in-memory LRU. Defaults to 4096.
+
+    #### outPorts:
+    - cache: The cache, whose `stats()` reports hits, misses and hit rate.
+    """
+
+    path: InArg[str]
+    max_memory_entries: InArg[int]
+    cache: OutArg[EmbeddingCache]
+
+    def execute(self, ctx) -> None:
+        cache = EmbeddingCache(
+            path=self.path.value,
+            max_memory_entries=self.max_memory_entries.value if self.max_memory_entries.value is not None else 4096
+        )
+        set_embedding_cache(cache)
+        self.cache.value = cache
+
+
 @xai_component
 class Toolbelt(Component):
     """A component that aggregates various GPT Agent tool specifications into a unified toolbelt.
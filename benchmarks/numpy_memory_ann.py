@@ -0,0 +1,65 @@
+"""Recall@k vs latency of NumpyMemoryImpl's IVF index against the exact scan.
+
+Uses synthetic clustered vectors, so no API key is needed:
+
+    python benchmarks/numpy_memory_ann.py --size 100000 --dim 384
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent_components import IVFIndex, NumpyMemoryImpl
+
+
+def clustered_vectors(rng, size, dim, clusters):
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size)
+    return centers[labels] + 0.5 * rng.normal(size=(size, dim)).astype(np.float32)
+
+
+def timed_search(memory, queries, k, exact):
+    found = []
+    start = time.perf_counter()
+    for query in queries:
+        found.append(memory.search(query, k, exact=exact)[0])
+    return found, (time.perf_counter() - start) / len(queries) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--metric", default="cosine")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = clustered_vectors(rng, args.size + args.queries, args.dim, clusters=max(16, args.size // 500))
+    data, queries = vectors[:args.size], vectors[args.size:]
+
+    index = IVFIndex(min_train_size=1)
+    memory = NumpyMemoryImpl(metric=args.metric, index=index)
+    start = time.perf_counter()
+    memory.append_vectors(data)
+    print(f"Indexed {args.size} x {args.dim} vectors into {len(index.lists)} lists "
+          f"in {time.perf_counter() - start:.2f}s")
+
+    truth, exact_ms = timed_search(memory, queries, args.k, exact=True)
+    print(f"{'mode':>12} {'recall@' + str(args.k):>10} {'ms/query':>10}")
+    print(f"{'exact':>12} {1.0:>10.3f} {exact_ms:>10.3f}")
+    for nprobe in args.nprobe:
+        index.nprobe = nprobe
+        found, ms = timed_search(memory, queries, args.k, exact=False)
+        recall = np.mean([len(np.intersect1d(a, b)) / args.k for a, b in zip(found, truth)])
+        print(f"{'nprobe=' + str(nprobe):>12} {recall:>10.3f} {ms:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
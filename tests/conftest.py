@@ -0,0 +1,23 @@
+import hashlib
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import agent_components
+
+
+def fake_embedding(text: str) -> np.ndarray:
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    return np.random.default_rng(seed).normal(size=16).astype(np.float32)
+
+
+@pytest.fixture
+def embeddings(monkeypatch):
+    """Replaces the embedding API with deterministic vectors derived from the text."""
+    monkeypatch.setattr(agent_components, "get_ada_embedding", fake_embedding)
+    monkeypatch.setattr(agent_components, "get_ada_embeddings", lambda texts: [fake_embedding(t) for t in texts])
+    return fake_embedding
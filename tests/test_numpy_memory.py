@@ -0,0 +1,114 @@
+import numpy as np
+
+from agent_components import IVFIndex, NumpyMemory, NumpyMemoryImpl, PersistentNumpyMemoryImpl, metadata_matches
+
+
+def test_component_opens_persistent_memory(tmp_path, embeddings):
+    component = NumpyMemory()
+    component.path.value = str(tmp_path / "memory")
+    component.execute({})
+
+    memory = component.memory.value
+    assert isinstance(memory, PersistentNumpyMemoryImpl)
+    memory.add("a", "hello", {"task": 1})
+    memory.close()
+
+    component.execute({})
+    assert [result.id for result in component.memory.value.query("hello", 1)] == ["a"]
+
+
+def test_ivf_search_widens_probes_to_find_k_live_rows():
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(8, 16)).astype(np.float32) * 10
+    vectors = np.repeat(centers, 50, axis=0) + rng.normal(size=(400, 16)).astype(np.float32)
+    index = IVFIndex(nlist=8, nprobe=1, min_train_size=1)
+    memory = NumpyMemoryImpl(index=index, compact_ratio=None)
+    memory.append([str(i) for i in range(400)], vectors, [{}] * 400)
+    assert index.trained
+
+    # Empty the cluster the query probes: the nearest live rows are now in other clusters.
+    probed = memory.top_k_indices(memory.scores(index.centroids, index.centroid_norms, centers[0]), 1)[0]
+    memory.delete([str(row) for row in index.lists[probed]])
+    indices, _ = memory.search(centers[0], 10)
+    assert len(indices) == 10
+    assert not memory.deleted[indices].any()
+
+
+def test_metadata_filters_match_with_and_without_index(embeddings):
+    long_text = "result " * 100
+    metadatas = [{"task_id": i, "result": long_text if i % 2 else "short", "tags": ["a"]} for i in range(6)]
+    filters = [
+        {"task_id": {"$gte": 2}},
+        {"result": long_text},
+        {"result": {"$ne": "short"}},
+        {"tags": ["a"]},
+        {"$or": [{"task_id": 0}, {"result": {"$exists": True}}]},
+    ]
+    for fields in (None, ["task_id"]):
+        memory = NumpyMemoryImpl(metadata_fields=fields)
+        memory.append([str(i) for i in range(6)], np.eye(6, 16), metadatas)
+        for filter in filters:
+            expected = [i for i, metadata in enumerate(metadatas) if metadata_matches(metadata, filter)]
+            assert memory.filter_rows(filter).tolist() == expected, (fields, filter)
+
+    index = memory.metadata_index
+    assert "result" not in index.postings and "tags" not in index.postings
+
+
+def test_persistent_memory_reopens_with_upserts_and_deletes(tmp_path, embeddings):
+    path = str(tmp_path / "memory")
+    memory = PersistentNumpyMemoryImpl(path)
+    memory.add_many(["a", "b", "c"], ["alpha", "beta", "gamma"], [{"n": 1}, {"n": 2}, {"n": 3}])
+    memory.add("b", "beta", {"n": 20})
+    memory.add("a", "alpha", {"n": 10}, namespace="other")
+    memory.delete(["c"])
+    memory.close()
+
+    memory = PersistentNumpyMemoryImpl(path)
+    results = memory.query("beta", 5)
+    assert sorted((result.id, result.attributes["n"]) for result in results) == [("a", 1), ("a", 10), ("b", 20)]
+    assert [result.attributes["n"] for result in memory.query("alpha", 5, namespace="other")] == [10]
+    memory.close()
+
+
+def test_persistent_memory_drops_torn_trailing_line(tmp_path, embeddings):
+    path = tmp_path / "memory"
+    memory = PersistentNumpyMemoryImpl(str(path))
+    memory.add_many(["a", "b"], ["alpha", "beta"], [{}, {}])
+    memory.close()
+
+    # A crash mid-append leaves a partial line and part of its offset behind.
+    size = (path / "entries.jsonl").stat().st_size
+    with open(path / "entries.jsonl", "ab") as f:
+        f.write(b'{"id": "c", "meta')
+    with open(path / "offsets.u64", "ab") as f:
+        f.write(size.to_bytes(8, "little") + b"\x01\x02")
+
+    memory = PersistentNumpyMemoryImpl(str(path))
+    assert memory.size == 2
+    memory.add("c", "gamma", {"n": 3})
+    memory.close()
+
+    memory = PersistentNumpyMemoryImpl(str(path))
+    assert [memory.ids[row] for row in range(memory.size)] == ["a", "b", "c"]
+    assert memory.query("gamma", 1)[0].attributes == {"n": 3}
+    memory.close()
+
+
+def test_persistent_memory_compaction_keeps_live_rows(tmp_path, embeddings):
+    path = str(tmp_path / "memory")
+    memory = PersistentNumpyMemoryImpl(path)
+    ids = [str(i) for i in range(10)]
+    memory.add_many(ids, ids, [{"n": i} for i in range(10)])
+    memory.delete(ids[:6])
+    memory.add("9", "9", {"n": 90})
+    memory.compact()
+
+    assert memory.size == 4 and memory.deleted_count == 0
+    assert not (tmp_path / "memory.old").exists() and not (tmp_path / "memory.compact").exists()
+    memory.close()
+
+    memory = PersistentNumpyMemoryImpl(path)
+    assert sorted((result.id, result.attributes["n"]) for result in memory.query("7", 10)) == \
+        [("6", 6), ("7", 7), ("8", 8), ("9", 90)]
+    memory.close()
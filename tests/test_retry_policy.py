@@ -0,0 +1,56 @@
+import httpx
+import openai
+import pytest
+
+from agent_components import RetryPolicy
+
+REQUEST = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+
+
+def status_error(status: int, headers: dict = None) -> openai.APIStatusError:
+    response = httpx.Response(status, headers=headers, request=REQUEST)
+    return openai.APIStatusError("error", response=response, body=None)
+
+
+@pytest.mark.parametrize("error, retryable", [
+    (status_error(429), True),
+    (status_error(500), True),
+    (status_error(408), True),
+    (status_error(400), False),
+    (status_error(401), False),
+    (openai.APIConnectionError(request=REQUEST), True),
+    (ValueError("bad"), False),
+])
+def test_retryable_errors(error, retryable):
+    assert RetryPolicy().is_retryable(error) == retryable
+
+
+def test_backoff_doubles_up_to_max_delay():
+    policy = RetryPolicy(max_attempts=10, base_delay=1.0, max_delay=5.0, deadline=None, jitter=False)
+    error = status_error(503)
+    assert [policy.next_delay(attempt, error, 0) for attempt in range(5)] == [1.0, 2.0, 4.0, 5.0, 5.0]
+
+
+def test_jitter_stays_within_backoff():
+    policy = RetryPolicy(base_delay=1.0, deadline=None)
+    delays = [policy.next_delay(2, status_error(500), 0) for _ in range(100)]
+    assert all(0 <= delay <= 4.0 for delay in delays)
+
+
+@pytest.mark.parametrize("headers, delay", [
+    ({"retry-after": "7"}, 7.0),
+    ({"retry-after-ms": "2500"}, 2.5),
+    ({"retry-after": "soon"}, 1.0),
+])
+def test_retry_after_raises_delay(headers, delay):
+    policy = RetryPolicy(base_delay=1.0, deadline=None, jitter=False)
+    assert policy.next_delay(0, status_error(429, headers), 0) == delay
+
+
+def test_gives_up_after_max_attempts_or_deadline():
+    policy = RetryPolicy(max_attempts=3, base_delay=1.0, deadline=10.0, jitter=False)
+    error = status_error(429)
+    assert policy.next_delay(1, error, 0) == 2.0
+    assert policy.next_delay(2, error, 0) is None
+    assert policy.next_delay(1, error, 9.0) is None
+    assert policy.next_delay(0, status_error(400), 0) is None
@@ -0,0 +1,47 @@
+import pytest
+
+from agent_components import SqliteTool, split_sql
+
+
+@pytest.fixture
+def sqlite_tool(tmp_path):
+    tool = SqliteTool()
+    tool.path.value = str(tmp_path / "test.db")
+    tool.execute({})
+    yield tool
+
+
+def run(tool, sql):
+    return tool.run_tool("sqlite\n```\n" + sql + "\n```")
+
+
+def test_split_sql_keeps_semicolons_in_literals():
+    assert split_sql("SELECT 'a;b'; SELECT 2;") == ["SELECT 'a;b'", "SELECT 2"]
+
+
+def test_split_sql_drops_comment_only_chunks():
+    assert split_sql("SELECT 1; -- done\n") == ["SELECT 1"]
+    assert split_sql("/* setup; */ ; SELECT '--x'") == ["SELECT '--x'"]
+
+
+def test_block_runs_in_one_call(sqlite_tool):
+    output = run(sqlite_tool, "CREATE TABLE t (x int);\nINSERT INTO t VALUES (1);\nINSERT INTO t VALUES (2);")
+    assert output == "OK, 3 statements executed\n"
+    assert run(sqlite_tool, "SELECT x FROM t ORDER BY x;") == "x\n1\n2\n"
+
+
+def test_failing_statement_rolls_back_the_block(sqlite_tool):
+    run(sqlite_tool, "CREATE TABLE t (x int UNIQUE);")
+    output = run(sqlite_tool, "INSERT INTO t VALUES (1);\nINSERT INTO t VALUES (1);")
+    assert "UNIQUE" in output and "Rolled back" in output
+    assert run(sqlite_tool, "SELECT count(*) AS n FROM t;") == "n\n0\n"
+
+    output = run(sqlite_tool, "INSERT INTO t VALUES (2);\nSELECT x FROM t;\nINSERT INTO t VALUES (2);")
+    assert "Rolled back" in output
+    assert run(sqlite_tool, "SELECT count(*) AS n FROM t;") == "n\n0\n"
+
+
+def test_results_are_bounded(sqlite_tool):
+    sqlite_tool.max_rows.value = 2
+    run(sqlite_tool, "CREATE TABLE t (x int);\n" + "\n".join(f"INSERT INTO t VALUES ({i});" for i in range(5)))
+    assert run(sqlite_tool, "SELECT x FROM t;") == "x\n0\n1\n... 3 more rows omitted\n"
@@ -0,0 +1,75 @@
+import pytest
+
+from agent_components import ToolBlockParser, ToolRunner, run_action_tools
+
+ACTIONS = [
+    "TOOL: scratch-pad\nremember ```x``` and more\n",
+    "Let me check.\nTOOL: python-exec\n```\nprint(1)\n```\nTOOL: scratch-pad\nnote\n",
+    "TOOL: python-exec\n```\nprint('TOOL')\n```\ntrailing text",
+    "no tools here",
+]
+
+
+class RecordingTool:
+    def __init__(self, name):
+        self.name = name
+        self.calls = []
+
+    def run_tool(self, tool_code):
+        self.calls.append(tool_code)
+        return f"[{self.name} ran {len(self.calls)}]\n"
+
+
+def stream_blocks(action, size):
+    parser = ToolBlockParser()
+    blocks = []
+    for start in range(0, len(action), size):
+        blocks += parser.feed(action[start:start + size])
+    return blocks + parser.finish()
+
+
+@pytest.mark.parametrize("action", ACTIONS)
+@pytest.mark.parametrize("size", [1, 3, 1000])
+def test_stream_blocks_match_split(action, size):
+    assert stream_blocks(action, size) == action.split("TOOL: ")
+
+
+@pytest.mark.parametrize("action", ACTIONS)
+def test_stream_and_complete_runs_call_tools_alike(action):
+    def tools():
+        return [{'name': name, 'instance': RecordingTool(name)} for name in ("scratch-pad", "python-exec")]
+
+    complete_tools = tools()
+    complete = run_action_tools(action, complete_tools)
+
+    runner = ToolRunner()
+    runner.tools.value = tools()
+    streamed = runner.run_stream(action[i:i + 2] for i in range(0, len(action), 2))
+
+    assert [t['instance'].calls for t in runner.tools.value] == [t['instance'].calls for t in complete_tools]
+    assert streamed == action.strip() + "\n" + complete[len(action) + 1:]
+
+
+class AsyncRecordingTool(RecordingTool):
+    async def run_tool_async(self, tool_code):
+        return "async " + self.run_tool(tool_code)
+
+
+def test_tool_runner_dispatches_async(embeddings):
+    import asyncio
+    from agent_components import NumpyMemoryImpl
+
+    async_tool = AsyncRecordingTool("scratch-pad")
+    sync_tool = RecordingTool("python-exec")
+    runner = ToolRunner()
+    runner.action.value = ACTIONS[1]
+    runner.tools.value = [{'name': 'scratch-pad', 'instance': async_tool}, {'name': 'python-exec', 'instance': sync_tool}]
+    runner.memory.value = NumpyMemoryImpl()
+    runner.task.value = {"task_id": 1, "task_name": "check"}
+
+    asyncio.run(runner.execute_async({}))
+
+    assert async_tool.calls == ["scratch-pad\nnote\n"]
+    assert sync_tool.calls == ["python-exec\n```\nprint(1)\n```\n"]
+    assert runner.result.value.endswith("[python-exec ran 1]\nasync [scratch-pad ran 1]\n")
+    assert runner.memory.value.size == 1